@@ -0,0 +1,197 @@
+#!/usr/bin/python
+"""
+On-disk cache of preprocessed input assets. Entries are keyed by a hash of the content of the input files and
+the parameters of the preprocessing, each entry is a directory of raw .npy arrays which are memory-mapped when
+they are loaded again. The total size of the cache is bounded, least recently used entries are evicted first.
+
+Every entry records the version of the cache it was stored with, entries of other versions are never hit and
+can be removed with Invalidate().
+"""
+
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+# Bump when the layout of the cached arrays changes, old entries are then never hit and age out
+CACHE_VERSION = 1
+
+# Name of the array recording the version of an entry
+VERSION_ARRAY = "_version"
+
+# Content hashes of input files, shared by every cache of the process so a file is hashed once per modification
+_fileHashes = {}
+
+
+class AssetCache(object):
+    def __init__(self, directory, maxSize=2 * 1024 ** 3, version=CACHE_VERSION):
+        """
+        Create an AssetCache object
+
+        :param directory:   [str] Directory of the cache, created if it does not exist
+        :param maxSize:     [int] Maximum total size of the cache in bytes
+        :param version:     [int] Version of the entries, e.g. the version of the algorithm producing them
+        :return:
+        """
+        self.directory = directory
+        self.maxSize = maxSize
+        self.version = version
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def GetFileHash(self, m_filename):
+        """
+        Return the hash of the content of a file. Hashes are remembered by all caches until the file is modified.
+
+        :param m_filename:  [str] Input file
+        :return: [str]
+        """
+        m_stat = os.stat(m_filename)
+        m_fileKey = (os.path.abspath(m_filename), m_stat.st_mtime, m_stat.st_size)
+        if m_fileKey not in _fileHashes:
+            m_hash = hashlib.sha1()
+            with open(m_filename, 'rb') as f:
+                for l_chunk in iter(lambda: f.read(1024 ** 2), b''):
+                    m_hash.update(l_chunk)
+            _fileHashes[m_fileKey] = m_hash.hexdigest()
+        return _fileHashes[m_fileKey]
+
+    def GetKey(self, m_filenames, *m_parameters):
+        """
+        Return the cache key of files preprocessed with the given parameters.
+
+        :param m_filenames:     [str] or [list] Input file or files, their contents are hashed
+        :param m_parameters:    Parameters of the preprocessing, converted with str()
+        :return: [str]
+        """
+        if isinstance(m_filenames, basestring):
+            m_filenames = [m_filenames]
+        m_hash = hashlib.sha1()
+        for l_filename in m_filenames:
+            m_hash.update(self.GetFileHash(l_filename))
+        m_hash.update(str((self.version,) + tuple(m_parameters)))
+        return m_hash.hexdigest()
+
+    def Load(self, m_key):
+        """
+        Return the arrays stored under m_key, memory-mapped copy-on-write, or None if there is no such entry.
+
+        :param m_key:   [str] Key from GetKey()
+        :return: [dict] Name to array
+        """
+        m_entry = os.path.join(self.directory, m_key)
+        if not os.path.isdir(m_entry):
+            return None
+        try:
+            m_arrays = {}
+            for l_filename in os.listdir(m_entry):
+                if l_filename.endswith(".npy"):
+                    m_arrays[l_filename[:-4]] = np.load(os.path.join(m_entry, l_filename), mmap_mode='c')
+            os.utime(m_entry, None)  # Mark as recently used
+        except (IOError, OSError, ValueError):
+            return None
+        if VERSION_ARRAY not in m_arrays or m_arrays.pop(VERSION_ARRAY)[0] != self.version:
+            return None
+        return m_arrays
+
+    def Store(self, m_key, m_arrays):
+        """
+        Store the arrays under m_key and evict old entries if the cache grows over its size limit. Nothing is
+        stored if the cache cannot be written to.
+
+        :param m_key:       [str]  Key from GetKey()
+        :param m_arrays:    [dict] Name to array
+        :return:
+        """
+        m_entry = os.path.join(self.directory, m_key)
+        m_tmpEntry = "%s.tmp%i" % (m_entry, os.getpid())
+        if os.path.isdir(m_entry):
+            return
+
+        # Write to a temporary directory first so other processes never see a partial entry
+        try:
+            os.mkdir(m_tmpEntry)
+            for l_name, l_array in m_arrays.items():
+                np.save(os.path.join(m_tmpEntry, "%s.npy" % l_name), np.ascontiguousarray(l_array))
+            np.save(os.path.join(m_tmpEntry, "%s.npy" % VERSION_ARRAY), np.array([self.version]))
+            os.rename(m_tmpEntry, m_entry)
+        except (IOError, OSError):
+            # Another process stored the same entry first, or the cache cannot be written to, e.g. the disk is
+            # full or the directory is read-only. The entry is then not cached, which is never fatal
+            pass
+        finally:
+            if os.path.isdir(m_tmpEntry):
+                shutil.rmtree(m_tmpEntry, ignore_errors=True)
+        try:
+            self.Evict()
+        except OSError:
+            pass
+
+    def GetEntries(self):
+        """
+        Return the entries of the cache sorted from least to most recently used.
+
+        :return: [list] List of (last use time, size in bytes, path)
+        """
+        m_entries = []
+        for l_key in os.listdir(self.directory):
+            l_entry = os.path.join(self.directory, l_key)
+            # Skip partial entries and other directories, e.g. a cache nested in this one
+            if not os.path.isdir(l_entry) or len(l_key) != hashlib.sha1().digest_size * 2:
+                continue
+            try:
+                l_size = sum([os.path.getsize(os.path.join(l_entry, f)) for f in os.listdir(l_entry)])
+                m_entries.append((os.path.getmtime(l_entry), l_size, l_entry))
+            except OSError:
+                continue
+        return sorted(m_entries)
+
+    def Evict(self, m_maxSize=None):
+        """
+        Remove least recently used entries until the total size of the cache is within m_maxSize.
+
+        :param m_maxSize:   [int] Size limit in bytes. Default to the size limit of the cache
+        :return: [int] Number of entries removed
+        """
+        if m_maxSize == None:
+            m_maxSize = self.maxSize
+        m_entries = self.GetEntries()
+        m_totalSize = sum([l_size for l_time, l_size, l_entry in m_entries])
+        m_removed = 0
+        for l_time, l_size, l_entry in m_entries:
+            if m_totalSize <= m_maxSize:
+                break
+            shutil.rmtree(l_entry, ignore_errors=True)
+            m_totalSize -= l_size
+            m_removed += 1
+        return m_removed
+
+    def Invalidate(self):
+        """
+        Remove every entry stored with another version of the cache.
+
+        :return: [int] Number of entries removed
+        """
+        m_removed = 0
+        for l_time, l_size, l_entry in self.GetEntries():
+            try:
+                l_version = np.load(os.path.join(l_entry, "%s.npy" % VERSION_ARRAY))[0]
+            except (IOError, OSError, ValueError):
+                l_version = None
+            if l_version != self.version:
+                shutil.rmtree(l_entry, ignore_errors=True)
+                m_removed += 1
+        return m_removed
+
+    def Clear(self):
+        """
+        Remove every entry of the cache.
+
+        :return:
+        """
+        self.Evict(0)
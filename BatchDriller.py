@@ -0,0 +1,229 @@
+#!/usr/bin/python
+"""
+Run HoleDriller on every job listed in a manifest with a pool of worker processes. VTK is imported once by
+the batch driver and each job runs in a forked worker, so jobs do not pay the interpreter start up again.
+
+The manifest is either a CSV file with a header row or a JSON file holding a list of objects. Keys are the
+long option names of HoleDriller, e.g. surface, centerline, holesPerSlice, numOfSlice, radius, padding,
+errorTorlerance, bufferAngle, bufferPolyLines, twoSides, output and outputOpening. The key marker is accepted
+for noDrillCoord, name gives the job a name in the report and timeout overrides the default timeout of the job.
+Switches of HoleDriller, e.g. twoSides, auto, localized or lean, are turned on by 1, true, yes or on.
+
+Job exit code list:
+0   Success
+1   IOError - Most likely Write Failed
+2   IOError - Cannot find surface/centerline files *OR* format of the input file is not correct
+3   RuntimeError - Tolerance errors, please set larger error tolerance
+4   ValueError - Slice alpha vector search reaches maximum tolerance
+5   Timeout - Job did not finish within the timeout and was terminated
+6   Unexpected error - The job raised an exception HoleDriller does not handle, the traceback is printed
+7   Bad arguments - HoleDriller rejected the options of the job
+
+Return exit code list:
+0   All jobs succeeded
+1   At least one job failed
+2   IOError - Cannot read the manifest or the manifest is not correct
+"""
+
+import csv
+import json
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+import traceback
+
+import HoleDriller
+
+TIMEOUT_EXIT_CODE = 5
+UNEXPECTED_EXIT_CODE = 6
+BAD_ARGUMENTS_EXIT_CODE = 7
+
+# Manifest keys which are HoleDriller switches without values
+FLAG_KEYS = [o.get_opt_string()[2:] for o in HoleDriller.GetOptionParser().option_list if o.action == "store_true"]
+
+# Manifest keys which are not passed to HoleDriller
+JOB_KEYS = ["name", "timeout"]
+
+KEY_ALIASES = {"marker": "noDrillCoord"}
+
+
+def ReadManifest(m_filename):
+    """
+    Read the manifest into a list of jobs.
+
+    :param m_filename:  [str] CSV or JSON manifest
+    :return: [list] List of dictionaries, one per job
+    """
+    if not os.path.isfile(m_filename):
+        raise IOError("Manifest file %s dosen't exist!" % m_filename)
+
+    if m_filename.split('.')[-1] == "json":
+        with open(m_filename) as f:
+            m_jobs = json.load(f)
+        if type(m_jobs) != list:
+            raise IOError("JSON manifest should hold a list of jobs")
+    elif m_filename.split('.')[-1] == "csv":
+        with open(m_filename) as f:
+            m_jobs = [dict((k.strip(), v.strip()) for k, v in row.items() if v != None and v.strip() != "")
+                      for row in csv.DictReader(f)]
+    else:
+        raise IOError("Manifest file should end with suffix .csv or .json!")
+
+    for i in xrange(len(m_jobs)):
+        for key in ["surface", "centerline"]:
+            if key not in m_jobs[i]:
+                raise IOError("Job %i of the manifest has no %s" % (i, key))
+    return m_jobs
+
+
+def GetJobArguments(m_job, m_index, m_outDir, m_quiet=False):
+    """
+    Convert a manifest job into a HoleDriller argument list. Jobs without an output name write to m_outDir,
+    named after the job.
+
+    :param m_job:       [dict]  A job of the manifest
+    :param m_index:     [int]   Index of the job in the manifest
+    :param m_outDir:    [str]   Directory of the outputs of jobs without output names
+    :param m_quiet:     [bool]  Suppress console outputs of the job
+    :return: [list] Argument list, starting with the program name
+    """
+    m_name = GetJobName(m_job, m_index)
+    m_job = dict((KEY_ALIASES.get(k, k), v) for k, v in m_job.items() if k not in JOB_KEYS)
+    if isinstance(m_job.get("noDrillCoord"), list):
+        m_job["noDrillCoord"] = ",".join([str(v) for v in m_job["noDrillCoord"]])
+    m_job.setdefault("output", os.path.join(m_outDir, "%s.stl" % m_name))
+    m_job.setdefault("outputOpening", os.path.join(m_outDir, "%s.vtp" % m_name))
+    if m_quiet:
+        m_job["quiet"] = True
+
+    m_args = ["HoleDriller.py"]
+    for key in sorted(m_job.keys()):
+        l_value = m_job[key]
+        if isinstance(l_value, unicode):  # JSON manifests hold unicode, HoleDriller expects byte strings
+            l_value = l_value.encode("utf-8")
+        if key in FLAG_KEYS:
+            if str(l_value).lower() in ["1", "true", "yes", "on"]:
+                m_args.append("--%s" % str(key))
+        else:
+            m_args.append("--%s=%s" % (str(key), l_value))
+    return m_args
+
+
+def GetJobName(m_job, m_index):
+    if "name" in m_job:
+        return str(m_job["name"])
+    return "%04i_%s" % (m_index, os.path.splitext(os.path.basename(m_job["surface"]))[0])
+
+
+def RunJob(m_args):
+    """
+    Worker process entry, exit with the exit code of HoleDriller. Options HoleDriller rejects are reported with
+    exit code 7, exceptions HoleDriller does not handle are printed and reported with exit code 6.
+
+    :param m_args:  [list] HoleDriller argument list
+    :return:
+    """
+    try:
+        m_exitCode = HoleDriller.main(m_args)
+    except SystemExit, err:
+        # optparse exits on options it cannot parse
+        m_exitCode = BAD_ARGUMENTS_EXIT_CODE if err.code not in [None, 0] else 0
+    except Exception:
+        traceback.print_exc()
+        m_exitCode = UNEXPECTED_EXIT_CODE
+    sys.exit(m_exitCode)
+
+
+def RunBatch(m_jobs, m_workers, m_timeout=0, m_outDir=".", m_quiet=False):
+    """
+    Run the jobs with at most m_workers processes at a time. A job running longer than its timeout is
+    terminated and reported with exit code 5.
+
+    :param m_jobs:      [list]  List of manifest jobs
+    :param m_workers:   [int]   Maximum number of concurrent jobs
+    :param m_timeout:   [float] Default timeout of each job in seconds, 0 for no timeout
+    :param m_outDir:    [str]   Directory of the outputs of jobs without output names
+    :param m_quiet:     [bool]  Suppress console outputs of the jobs
+    :return: [list] Summary of each job, in the order of the manifest
+    """
+    m_pending = range(len(m_jobs))
+    m_running = {}
+    m_summary = [None] * len(m_jobs)
+
+    while len(m_pending) != 0 or len(m_running) != 0:
+        # Fill up the free workers
+        while len(m_pending) != 0 and len(m_running) < m_workers:
+            l_index = m_pending.pop(0)
+            l_process = multiprocessing.Process(target=RunJob,
+                                                args=(GetJobArguments(m_jobs[l_index], l_index, m_outDir, m_quiet),))
+            l_process.start()
+            m_running[l_index] = (l_process, time.time(), float(m_jobs[l_index].get("timeout", m_timeout)))
+
+        for l_index in m_running.keys():
+            l_process, l_start, l_timeout = m_running[l_index]
+            l_elapsed = time.time() - l_start
+            if not l_process.is_alive():
+                l_process.join()
+                l_exitCode = l_process.exitcode
+            elif l_timeout > 0 and l_elapsed > l_timeout:
+                l_process.terminate()
+                l_process.join()
+                l_exitCode = TIMEOUT_EXIT_CODE
+            else:
+                continue
+
+            del m_running[l_index]
+            m_summary[l_index] = {"name": GetJobName(m_jobs[l_index], l_index),
+                                  "surface": m_jobs[l_index]["surface"],
+                                  "exitCode": l_exitCode,
+                                  "time": l_elapsed}
+            if not m_quiet:
+                print "[%i/%i] %s finished with exit code %i in %.2f s" % (
+                    len([s for s in m_summary if s != None]), len(m_jobs), m_summary[l_index]["name"],
+                    l_exitCode, l_elapsed)
+        time.sleep(0.05)
+
+    return m_summary
+
+
+def main(args):
+    parser = optparse.OptionParser(usage="%prog [options] manifest")
+    parser.add_option("-q", "--quiet", action="store_true", dest="quiet", default=False, help="Suppress console outputs")
+    parser.add_option("-w", "--workers", action="store", dest="workers", type=int, default=multiprocessing.cpu_count(),
+                      help="Set maximum number of concurrent jobs")
+    parser.add_option("-T", "--timeout", action="store", dest="timeout", type=float, default=0,
+                      help="Set timeout of each job in seconds, 0 for no timeout")
+    parser.add_option("-o", "--outputDir", action="store", dest="outDir", type=str, default=".",
+                      help="Set output directory of jobs without output file names")
+    parser.add_option("-r", "--report", action="store", dest="report", type=str, default="batch_report.json",
+                      help="Set output summary report json file name")
+
+    (options, args) = parser.parse_args(args[1:])
+
+    try:
+        if len(args) != 1:
+            raise IOError("[Error] Please specify exactly one manifest file!")
+        m_jobs = ReadManifest(args[0])
+        if not os.path.isdir(options.outDir):
+            os.makedirs(options.outDir)
+    except IOError, err:
+        if not options.quiet:
+            print str(err)
+        return 2
+
+    m_summary = RunBatch(m_jobs, max(options.workers, 1), options.timeout, options.outDir, options.quiet)
+    with open(options.report, 'w') as f:
+        json.dump(m_summary, f, indent=2)
+
+    m_failed = [s for s in m_summary if s["exitCode"] != 0]
+    if not options.quiet:
+        print "%i of %i jobs succeeded. Report written to %s" % (len(m_summary) - len(m_failed), len(m_summary),
+                                                                 options.report)
+    return 0 if len(m_failed) == 0 else 1
+
+
+if __name__ == '__main__':
+    exitCode = main(sys.argv)
+    exit(exitCode)
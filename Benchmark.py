@@ -0,0 +1,302 @@
+#!/usr/bin/python
+"""
+Benchmark the hole driller pipeline on synthetic surfaces. Curved tubes and flared arms with elliptic cross
+sections are generated together with their centerlines at several mesh resolutions, the stages of the pipeline
+are timed separately and compared with a stored baseline.
+
+Usage:
+    python Benchmark.py --save          Run and store the timings as the baseline
+    python Benchmark.py                 Run and report the timings relative to the baseline
+
+Return exit code list:
+0   Success, no regression
+1   At least one stage is slower than the baseline by more than the threshold
+2   IOError - Cannot write the synthetic data or read/write the baseline
+"""
+
+import json
+import math
+import optparse
+import os
+import sys
+import time
+
+import numpy as np
+
+import VTKModules as vtk
+from PolyDataHandler import CenterLineHandler, ArmSurfaceHandler, NumpyToPolyData
+
+# Shape of the synthetic casts, flare is the relative growth of the radius towards the end of the centerline
+# and ellipticity the relative difference of the two axes of the cross section
+CASES = {"tube": {"flare": 0., "ellipticity": 0.},
+         "arm": {"flare": 0.6, "ellipticity": 0.2}}
+
+STAGES = ["CenterLineHandler.Read", "ArmSurfaceHandler.Read", "GetSemiUniDistnaceGrid", "SliceSurface",
+          "SphereDrill", "SphereDrill(localized,analytic)"]
+
+LENGTH = 200.
+RADIUS = 30.
+BEND = 10.
+
+
+def CenterlinePoint(m_t):
+    """
+    Return the points and unit tangents of the synthetic centerline, a planar curve bent in the xz plane.
+
+    :param m_t: [numpy.ndarray] Curve parameters between 0 and 1
+    :return: [numpy.ndarray, numpy.ndarray] Nx3 points and Nx3 unit tangents
+    """
+    m_z = LENGTH * m_t
+    m_points = np.column_stack([BEND * np.sin(m_z / 80.), np.zeros(len(m_t)), m_z])
+    m_tangents = np.column_stack([BEND / 80. * np.cos(m_z / 80.), np.zeros(len(m_t)), np.ones(len(m_t))])
+    return m_points, m_tangents / np.sqrt(np.sum(m_tangents ** 2, axis=1))[:, np.newaxis]
+
+
+def GenerateCenterline(m_numberOfPoints=40):
+    """
+    Create the synthetic centerline as a single polyline
+
+    :param m_numberOfPoints:    [int] Number of points of the polyline
+    :return: [vtkPolyData]
+    """
+    m_points, m_tangents = CenterlinePoint(np.linspace(0, 1, m_numberOfPoints))
+    return NumpyToPolyData(m_points, np.arange(m_numberOfPoints).reshape(1, -1), m_lines=True)
+
+
+def GenerateSurface(m_sides, m_flare=0., m_ellipticity=0.):
+    """
+    Create a triangulated open tube around the synthetic centerline. The number of rings is twice the number
+    of sides, so the surface has 4 * m_sides ** 2 triangles.
+
+    :param m_sides:         [int]   Number of points on each ring
+    :param m_flare:         [float] Relative growth of the radius along the centerline
+    :param m_ellipticity:   [float] Relative difference of the axes of the cross section
+    :return: [vtkPolyData]
+    """
+    m_rings = 2 * m_sides
+    m_t = np.linspace(0, 1, m_rings)
+    m_centers, m_tangents = CenterlinePoint(m_t)
+
+    # The curve is planar, so the y axis is normal to every tangent
+    m_u = np.tile([0., 1., 0.], (m_rings, 1))
+    m_v = np.cross(m_tangents, m_u)
+    m_theta = np.linspace(0, 2 * math.pi, m_sides, endpoint=False)
+    m_radius = RADIUS * (1 + m_flare * m_t ** 2)
+
+    m_a = (m_radius * (1 + m_ellipticity))[:, np.newaxis, np.newaxis]
+    m_b = (m_radius * (1 - m_ellipticity))[:, np.newaxis, np.newaxis]
+    m_points = m_centers[:, np.newaxis, :] + \
+        m_a * np.cos(m_theta)[np.newaxis, :, np.newaxis] * m_u[:, np.newaxis, :] + \
+        m_b * np.sin(m_theta)[np.newaxis, :, np.newaxis] * m_v[:, np.newaxis, :]
+
+    # Two triangles between each pair of neighbouring points on neighbouring rings
+    m_ring = np.arange(m_rings - 1)[:, np.newaxis] * m_sides
+    m_side = np.arange(m_sides)[np.newaxis, :]
+    m_first = (m_ring + m_side).ravel()
+    m_second = (m_ring + (m_side + 1) % m_sides).ravel()
+    m_triangles = np.vstack([np.column_stack([m_first, m_second, m_first + m_sides]),
+                             np.column_stack([m_second, m_second + m_sides, m_first + m_sides])])
+    return NumpyToPolyData(m_points.reshape(-1, 3), m_triangles)
+
+
+def GetOpeningMarker(m_flare=0., m_ellipticity=0.):
+    """
+    Return a point on the synthetic surface near the start of the centerline, used as the opening marker.
+
+    :return: [x, y, z]
+    """
+    m_t = 0.1
+    m_centers, m_tangents = CenterlinePoint(np.array([m_t]))
+    return (m_centers[0] + RADIUS * (1 + m_flare * m_t ** 2) * (1 + m_ellipticity) * np.array([0., 1., 0.])).tolist()
+
+
+def WriteData(m_dataDir, m_resolutions):
+    """
+    Write the synthetic centerline and surfaces of every case and resolution.
+
+    :param m_dataDir:       [str]  Output directory
+    :param m_resolutions:   [list] Numbers of sides of the surfaces
+    :return: [str, dict] Centerline file name and case name to surface file name
+    """
+    if not os.path.isdir(m_dataDir):
+        os.makedirs(m_dataDir)
+
+    m_centerlineFileName = os.path.join(m_dataDir, "centerline.vtp")
+    m_writer = vtk.vtkXMLPolyDataWriter()
+    m_writer.SetFileName(m_centerlineFileName)
+    m_writer.SetInputData(GenerateCenterline())
+    if m_writer.Write() != 1:
+        raise IOError("[Error] Cannot write %s" % m_centerlineFileName)
+
+    m_surfaceFileNames = {}
+    for l_case in sorted(CASES.keys()):
+        for l_sides in m_resolutions:
+            l_fileName = os.path.join(m_dataDir, "%s_%i.stl" % (l_case, l_sides))
+            l_writer = vtk.vtkSTLWriter()
+            l_writer.SetFileName(l_fileName)
+            l_writer.SetFileTypeToBinary()
+            l_writer.SetInputData(GenerateSurface(l_sides, CASES[l_case]["flare"],
+                                                 CASES[l_case]["ellipticity"]))
+            if l_writer.Write() != 1:
+                raise IOError("[Error] Cannot write %s" % l_fileName)
+            m_surfaceFileNames["%s_%i" % (l_case, l_sides)] = l_fileName
+    return m_centerlineFileName, m_surfaceFileNames
+
+
+def TimeStage(m_setup, m_run, m_repeats):
+    """
+    Return the best time of m_repeats runs, m_setup is called untimed before each run and its result is passed
+    to m_run.
+
+    :param m_setup:     [callable] Untimed preparation
+    :param m_run:       [callable] Timed stage
+    :param m_repeats:   [int] Number of runs
+    :return: [float] Seconds
+    """
+    m_best = None
+    for i in xrange(m_repeats):
+        l_input = m_setup()
+        l_start = time.time()
+        m_run(l_input)
+        l_elapsed = time.time() - l_start
+        if m_best == None or l_elapsed < m_best:
+            m_best = l_elapsed
+    return m_best
+
+
+def RunCase(m_centerlineFileName, m_surfaceFileName, m_case, m_repeats=3):
+    """
+    Time the stages of the pipeline on one synthetic surface. Every run starts from freshly read objects with
+    the ring cache disabled, so no run reuses the work of another.
+
+    :param m_centerlineFileName:    [str] Centerline file
+    :param m_surfaceFileName:       [str] Surface file
+    :param m_case:                  [str] Key of CASES
+    :param m_repeats:               [int] Number of runs of each stage, the best is kept
+    :return: [dict] Stage name to seconds
+    """
+    m_marker = GetOpeningMarker(CASES[m_case]["flare"], CASES[m_case]["ellipticity"])
+    m_plan = (10, 5, 5, 20, 10, 40)
+    m_holeRadius = 3
+
+    def NewCenterline():
+        return CenterLineHandler(m_centerlineFileName)
+
+    def NewSurface():
+        l_centerline = CenterLineHandler(m_centerlineFileName)
+        l_centerline.Read()
+        return ArmSurfaceHandler(m_surfaceFileName, l_centerline, m_marker, ringCacheSize=0)
+
+    def ReadSurface():
+        l_surface = NewSurface()
+        l_surface.Read()
+        return l_surface
+
+    def PlannedSurface():
+        l_surface = ReadSurface()
+        return l_surface, l_surface.GetSemiUniDistnaceGrid(*m_plan)
+
+    def SlicePlanes(m_surface):
+        l_intervals, l_average = m_surface.GetSlicePlanes(m_plan[1], m_plan[3], m_plan[4])
+        for l_id in l_intervals:
+            m_surface.SliceSurface(m_surface._centerLine.GetPoint(l_id), l_average)
+
+    m_timings = {}
+    m_timings["CenterLineHandler.Read"] = TimeStage(NewCenterline, lambda c: c.Read(), m_repeats)
+    m_timings["ArmSurfaceHandler.Read"] = TimeStage(NewSurface, lambda s: s.Read(), m_repeats)
+    m_timings["GetSemiUniDistnaceGrid"] = TimeStage(ReadSurface, lambda s: s.GetSemiUniDistnaceGrid(*m_plan),
+                                                    m_repeats)
+    m_timings["SliceSurface"] = TimeStage(ReadSurface, SlicePlanes, m_repeats)
+    m_timings["SphereDrill"] = TimeStage(PlannedSurface, lambda p: p[0].SphereDrill(p[1], m_holeRadius, True),
+                                         m_repeats)
+    m_timings["SphereDrill(localized,analytic)"] = TimeStage(
+        PlannedSurface, lambda p: p[0].SphereDrill(p[1], m_holeRadius, True, m_localized=True, m_analytic=True),
+        m_repeats)
+    return m_timings
+
+
+def CompareBaseline(m_results, m_baseline, m_threshold, m_minimumDelta=0.01):
+    """
+    Compare the timings with the baseline.
+
+    :param m_results:       [dict]  Case name to stage timings
+    :param m_baseline:      [dict]  Case name to stage timings of the baseline
+    :param m_threshold:     [float] Relative slow down reported as a regression
+    :param m_minimumDelta:  [float] Slow downs smaller than this number of seconds are ignored as noise
+    :return: [list] List of (case, stage, seconds, baseline seconds or None, regression flag)
+    """
+    m_rows = []
+    for l_case in sorted(m_results.keys()):
+        for l_stage in STAGES:
+            l_time = m_results[l_case][l_stage]
+            l_base = m_baseline.get(l_case, {}).get(l_stage)
+            l_regression = l_base != None and l_time > l_base * (1 + m_threshold) and \
+                l_time - l_base > m_minimumDelta
+            m_rows.append((l_case, l_stage, l_time, l_base, l_regression))
+    return m_rows
+
+
+def main(args):
+    parser = optparse.OptionParser()
+    parser.add_option("-q", "--quiet", action="store_true", dest="quiet", default=False, help="Suppress console outputs")
+    parser.add_option("-r", "--resolutions", action="store", dest="resolutions", type=str, default="64,128,256",
+                      help="Set numbers of sides of the synthetic surfaces, a surface has 4 * sides^2 triangles")
+    parser.add_option("-n", "--repeats", action="store", dest="repeats", type=int, default=3,
+                      help="Set number of runs of each stage, the best time is kept")
+    parser.add_option("-d", "--dataDir", action="store", dest="dataDir", type=str, default="./BenchmarkData",
+                      help="Set directory of the synthetic data")
+    parser.add_option("-b", "--baseline", action="store", dest="baseline", type=str, default="benchmark_baseline.json",
+                      help="Set baseline timings json file name")
+    parser.add_option("-s", "--save", action="store_true", dest="save", default=False,
+                      help="Store the timings as the new baseline")
+    parser.add_option("-t", "--threshold", action="store", dest="threshold", type=float, default=0.2,
+                      help="Set relative slow down reported as a regression")
+    parser.add_option("-o", "--output", action="store", dest="output", type=str, default=None,
+                      help="Set output timings json file name")
+
+    (options, args) = parser.parse_args(args[1:])
+    resolutions = [int(r) for r in options.resolutions.split(',')]
+
+    try:
+        centerlineFileName, surfaceFileNames = WriteData(options.dataDir, resolutions)
+
+        results = {}
+        for case in sorted(surfaceFileNames.keys()):
+            results[case] = RunCase(centerlineFileName, surfaceFileNames[case], case.split('_')[0], options.repeats)
+            if not options.quiet:
+                print "%s finished" % case
+
+        baseline = {}
+        if options.save:
+            with open(options.baseline, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        elif os.path.isfile(options.baseline):
+            with open(options.baseline) as f:
+                baseline = json.load(f)
+        if options.output != None:
+            with open(options.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+    except IOError, err:
+        if not options.quiet:
+            print str(err)
+        return 2
+
+    rows = CompareBaseline(results, baseline, options.threshold)
+    if not options.quiet:
+        print "%-10s %-32s %10s %10s %8s" % ("case", "stage", "time [s]", "base [s]", "ratio")
+        for case, stage, seconds, base, regression in rows:
+            if base == None:
+                print "%-10s %-32s %10.4f %10s %8s" % (case, stage, seconds, "-", "-")
+            else:
+                print "%-10s %-32s %10.4f %10.4f %8.2f%s" % (case, stage, seconds, base, seconds / max(base, 1e-9),
+                                                             "  REGRESSION" if regression else "")
+        if options.save:
+            print "Baseline written to %s" % options.baseline
+        elif len(baseline) == 0:
+            print "No baseline found at %s, run with --save to store one" % options.baseline
+    return 1 if any([row[4] for row in rows]) else 0
+
+
+if __name__ == '__main__':
+    exitCode = main(sys.argv)
+    exit(exitCode)
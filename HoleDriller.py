@@ -14,18 +14,78 @@ Return exit code  list:
 import optparse
 import os
 import sys
+from multiprocessing.pool import ThreadPool
 
-import vtk
+import numpy as np
 
-from PolyDataHandler import CenterLineHandler, ArmSurfaceHandler
+import VTKModules as vtk
+from AssetCache import AssetCache
+from PolyDataHandler import CenterLineHandler, ArmSurfaceHandler, PLAN_VERSION, PolyDataToNumpy
+from Tracing import TRACER
 
+# Share of --cacheSize given to the hole plans, the parsed surfaces and centerlines get the rest
+PLAN_CACHE_SHARE = 0.1
 
-def main(args):
+
+def WriteTraced(m_writer):
+    """
+    Write with a vtk writer, timed as a write span
+
+    :param m_writer:    vtk writer with input and file name set
+    :return: [int] Return value of Write()
+    """
+    with TRACER.Span("write"):
+        return m_writer.Write()
+
+
+def WriteSurface(m_data, m_filename, m_binary=False):
+    """
+    Write the drilled surface, the format follows the suffix of m_filename. STL files are ASCII unless m_binary
+    is set, VTP files are written with raw appended zlib compressed data and NPZ files hold the raw point and
+    triangle arrays.
+
+    :param m_data:      [vtkPolyData] Drilled surface
+    :param m_filename:  [str]  Output file name ending with .stl, .vtp or .npz
+    :param m_binary:    [bool] Write binary STL
+    :return: [int] 1 if the write succeeded, 0 otherwise, as Write() of vtk writers
+    """
+    with TRACER.Span("write"):
+        m_suffix = m_filename.split('.')[-1]
+        if m_suffix == "npz":
+            m_points, m_triangles = PolyDataToNumpy(m_data)
+            try:
+                np.savez(m_filename, points=m_points, triangles=m_triangles)
+            except (IOError, OSError):
+                return 0
+            return 1
+
+        if m_suffix == "vtp":
+            m_writer = vtk.vtkXMLPolyDataWriter()
+            m_writer.SetDataModeToAppended()
+            m_writer.EncodeAppendedDataOff()
+            m_writer.SetCompressorTypeToZLib()
+        else:
+            m_writer = vtk.vtkSTLWriter()
+            if m_binary:
+                m_writer.SetFileTypeToBinary()
+        m_writer.SetFileName(m_filename)
+        m_writer.SetInputData(m_data)
+        return m_writer.Write()
+
+
+def GetOptionParser():
+    """
+    Return the command line parser of HoleDriller
+
+    :return: [optparse.OptionParser]
+    """
     parser = optparse.OptionParser()
     parser.add_option("-s", "--surface",action="store", dest="surface", default=True,help="Input surface filename.")
     parser.add_option("-q", "--quiet",action="store_true", dest="quiet", default=False,help="Suppress console outputs")
     parser.add_option("-c", "--centerline",action="store", dest="centerline", default=True,help="Input centerline filename.")
-    parser.add_option("-o", "--output", action="store", dest="outFileName", type=str, default="drilled.stl", help="Set output casting surface stl file name")
+    parser.add_option("-o", "--output", action="store", dest="outFileName", type=str, default="drilled.stl",
+                      help="Set output casting surface file name. Suffix .stl writes STL, .vtp writes compressed VTP and .npz writes the raw point and triangle arrays")
+    parser.add_option("-x", "--binaryStl", action="store_true", dest="binaryStl", default=False, help="Write binary instead of ASCII STL")
     parser.add_option("-O", "--outputOpening", action="store", dest="outOpeningFileName", type=str, default="buff.vtp", help="Set output buffer points vtp file name")
     parser.add_option("-m", "--holesPerSlice", action="store", dest="holesPerSlice", type=int, default=5, help="Set number of holes per slice")
     parser.add_option("-n", "--numOfSlice", action="store", dest="numOfSlice", type=int ,default=5, help="Set number of slices")
@@ -36,16 +96,47 @@ def main(args):
     parser.add_option("-b", "--bufferAngle", action="store", dest="bufferAngle", type=float, default=0, help="Buffer angle which decide the buffer area, calculated in degrees")
     parser.add_option("-B", "--bufferPolyLines", action="store", dest="bufferPDs", type=str, default=None,
                       help="Specify buffer region by polylines. Seperate filenames with ';'. If this option is selected, buffer angle will be ignored.")
+    parser.add_option("-k", "--bufferClearance", action="store", dest="bufferClearance", type=float, default=20,
+                      help="Set minimum distance of the holes to the buffer polylines in mm")
     parser.add_option("-t", "--twoSides", action="store_true", dest="twoSides", default=False,
                       help="If this option is selected, there will be two openning buffer space and output will consist two polylines in one polydata.")
-    parser.add_option("-a", "--auto", action="store_true", dest="auto", default=False, help="Automatically determine parameters")
+    parser.add_option("-R", "--maxErrorTorlerance", action="store", dest="maxError", type=float, default=None,
+                      help="Relax the error tolerance of the slices failing the error tolerance up to this value in degrees instead of aborting")
+    parser.add_option("-a", "--auto", action="store_true", dest="auto", default=False,
+                      help="Automatically determine holes per slice, number of slices and error tolerance. The plan with the fewest holes meeting the hole density is used")
+    parser.add_option("-D", "--density", action="store", dest="density", type=float, default=None,
+                      help="Set target hole density of automatic parameters in holes per cm^2. Default to the density of the plan of the given holes per slice and number of slices")
+    parser.add_option("-z", "--reduction", action="store", dest="reduction", type=float, default=None,
+                      help="Plan the holes on a decimated surface with this fraction of the cells removed, then snap them to the full surface")
+    parser.add_option("-l", "--localized", action="store_true", dest="localized", default=False,
+                      help="Only clip the surface cells near the holes when drilling")
+    parser.add_option("-S", "--analytic", action="store_true", dest="analytic", default=False,
+                      help="Clip holes against the exact union of spheres instead of sphere glyphs")
+    parser.add_option("-P", "--processes", action="store", dest="processes", type=int, default=1,
+                      help="Set number of worker processes clipping the surface and evaluating automatic parameters")
+    parser.add_option("-C", "--cacheDir", action="store", dest="cacheDir", type=str, default=None,
+                      help="Set directory caching parsed surfaces and centerlines between runs")
+    parser.add_option("--cacheSize", action="store", dest="cacheSize", type=float, default=2048,
+                      help="Set maximum total size of the cache directory in MB, a tenth of it is kept for hole plans")
+    parser.add_option("-j", "--threads", action="store", dest="threads", type=int, default=1, help="Set number of threads used to process slices")
+    parser.add_option("-L", "--lean", action="store_true", dest="lean", default=False,
+                      help="Memory-lean mode, hand over filter outputs by shallow copies and release them as soon as they are consumed")
+    parser.add_option("-f", "--singlePrecision", action="store_true", dest="singlePrecision", default=False,
+                      help="Convert double precision surface points, e.g. of VTP surfaces, to float32. STL surfaces are single precision already")
+    parser.add_option("-T", "--trace", action="store", dest="trace", type=str, default=None,
+                      help="Write stage timings, counters and peak memory to a json trace file")
+    return parser
 
 
-    (options, args) = parser.parse_args()
+def main(args):
+    parser = GetOptionParser()
+    (options, args) = parser.parse_args(args[1:])
     surfaceFileName = options.surface
     centerlineFileName = options.centerline
     outFileName = options.outFileName
     [startPadding, endPadding] = [int(options.padding.split(",")[i]) for i in xrange(2)]
+    if options.trace != None:
+        TRACER.Enable()
 
     try:
         if not os.path.isfile(surfaceFileName):
@@ -60,6 +151,10 @@ def main(args):
             if not options.quiet:
                 print "[Error] Name specified for buffer opening points should end with suffix .vtp!"
             raise IOError("Name specified for buffer opening points should end with suffix .vtp!")
+        if outFileName.split('.')[-1] not in ["stl", "vtp", "npz"]:
+            if not options.quiet:
+                print "[Error] Name specified for output casting surface should end with suffix .stl, .vtp or .npz!"
+            raise IOError("Name specified for output casting surface should end with suffix .stl, .vtp or .npz!")
 
         if type(options.omitted) != None and type(options.omitted) != str and options.bufferAngle != 0:
             raise TypeError("[Error] Start drill coordinates should be specified with strings")
@@ -67,53 +162,107 @@ def main(args):
             openingMarker = [float(options.omitted.split(',')[i]) for i in xrange(3)]
 
 
+        cache = None
+        planCache = None
+        if options.cacheDir != None:
+            cache = AssetCache(options.cacheDir, int(options.cacheSize * (1 - PLAN_CACHE_SHARE) * 1024 ** 2))
+            planCache = AssetCache(os.path.join(options.cacheDir, "plans"),
+                                   int(options.cacheSize * PLAN_CACHE_SHARE * 1024 ** 2), version=PLAN_VERSION)
+
         # create center line object
-        cl = CenterLineHandler(centerlineFileName)
+        cl = CenterLineHandler(centerlineFileName, cache=cache)
         cl.Read()
 
         # careate arm object
-        arm = ArmSurfaceHandler(surfaceFileName, cl, openingMarker)
+        arm = ArmSurfaceHandler(surfaceFileName, cl, openingMarker, cache=cache, planCache=planCache,
+                                lean=options.lean, singlePrecision=options.singlePrecision)
         arm.Read()
         if (options.bufferAngle > 0):
             arm.SetBufferAngle(options.bufferAngle)
         elif (options.bufferPDs != None):
             arm.SetBufferPolyLines(options.bufferPDs)
+            arm.SetBufferClearance(options.bufferClearance)
             arm.SetBufferAngle(0)
 
-        # Get a list of holes and then drill
-        holelist = arm.GetSemiUniDistnaceGrid(options.holesPerSlice + 1, options.numOfSlice - 1, options.error,
-                                              startPadding, endPadding, options.bufferAngle, options.twoSides)
-        arm.SphereDrill(holelist, options.radius, options.quiet)
-
-        clippermapper = vtk.vtkPolyDataMapper()
-        if vtk.vtkVersion().GetVTKVersion < 6:
-            clippermapper.SetInput(arm._data)
+        # Get a list of holes and then drill, planning on a decimated surface if requested
+        if options.auto:
+            density = options.density
+            if density == None:
+                # Density of the plan the given holes per slice and number of slices produce
+                try:
+                    baseline = len(arm.GetSemiUniDistnaceGrid(options.holesPerSlice + 1, options.numOfSlice - 1,
+                                                              options.error, startPadding, endPadding,
+                                                              options.bufferAngle, options.twoSides,
+                                                              m_threads=options.threads))
+                except (RuntimeError, ValueError):
+                    baseline = options.holesPerSlice * len(arm.GetSlicePlanes(options.numOfSlice - 1, startPadding,
+                                                                              endPadding)[0])
+                density = baseline / (arm.GetSurfaceArea() / 100.)
+            tolerances = [options.error * 2 ** i for i in xrange(4)]
+            holelist, found = arm.SearchSemiUniDistnaceGrid(density, options.radius, tolerances, startPadding,
+                                                            endPadding, options.bufferAngle, options.twoSides,
+                                                            m_processes=options.processes, m_threads=options.threads,
+                                                            m_reduction=options.reduction)
+            if not options.quiet:
+                print "Automatic parameters: holesPerSlice=%i numOfSlice=%i errorTorlerance=%g (%i holes)" % (
+                    found[0] - 1, found[1] + 1, found[2], len(holelist))
         else:
-            clippermapper.SetInputData(arm._data)
-
-        writer = vtk.vtkSTLWriter()
-        writer.SetFileName(outFileName)
-        writer.SetInputData(arm._data)
+            gridArgs = (options.holesPerSlice + 1, options.numOfSlice - 1, options.error, startPadding, endPadding,
+                        options.bufferAngle, options.twoSides)
+            gridKwargs = {'m_threads': options.threads, 'm_maxErrorTolerance': options.maxError}
+            if options.reduction != None:
+                holelist = arm.GetCoarseSemiUniDistnaceGrid(options.reduction, *gridArgs, **gridKwargs)
+            else:
+                holelist = arm.GetSemiUniDistnaceGrid(*gridArgs, **gridKwargs)
+            if not options.quiet:
+                for sliceIndex, tolerance in arm._relaxedSlices:
+                    print "Slice %i error tolerance relaxed to %.4f" % (sliceIndex, tolerance)
+        arm.SphereDrill(holelist, options.radius, options.quiet, m_localized=options.localized,
+                        m_analytic=options.analytic, m_processes=options.processes)
 
         # Make a polyline
         polyline = arm.GetOpenningLine()
 
+        # Write the opening line to a temporary file in another thread while the cast is written, it only
+        # replaces the output opening line once the cast is written
+        polylineTmpFileName = "%s.%i.tmp" % (options.outOpeningFileName, os.getpid())
         polylineWriter = vtk.vtkXMLPolyDataWriter()
         polylineWriter.SetInputData(polyline)
-        polylineWriter.SetFileName(options.outOpeningFileName)
+        polylineWriter.SetFileName(polylineTmpFileName)
 
-        if writer.Write() != 1:
+        writePool = ThreadPool(1)
+        try:
+            if options.bufferPDs == None:
+                polylineWritten = writePool.apply_async(WriteTraced, (polylineWriter,))
+            written = WriteSurface(arm._data, outFileName, options.binaryStl)
+            if options.bufferPDs == None:
+                polylineWritten = polylineWritten.get()
+                if written == 1 and polylineWritten == 1:
+                    try:
+                        if os.path.isfile(options.outOpeningFileName):
+                            os.remove(options.outOpeningFileName)
+                        os.rename(polylineTmpFileName, options.outOpeningFileName)
+                    except OSError:
+                        polylineWritten = 0
+        finally:
+            writePool.close()
+            writePool.join()
+            if os.path.isfile(polylineTmpFileName):
+                os.remove(polylineTmpFileName)
+
+        if written != 1:
             if not options.quiet:
                 raise IOError("[Error] Write failed...")
             return 1
         else:
             if not options.quiet:
                 print "Successful. File written to %s"%(options.outFileName)
+                print "Peak memory = %.1f MB" % (TRACER.GetPeakRSS() / 1024.)
 
             if (options.bufferPDs != None):
                 if not options.quiet:
                     print "No drill region supplied, there will not be opening line output!"
-            elif polylineWriter.Write() != 1:
+            elif polylineWritten != 1:
                 if not options.quiet:
                     raise IOError("[Error] Opening line write failed")
                 return 1
@@ -133,6 +282,14 @@ def main(args):
         if not options.quiet:
             print str(err)
         return 4
+    finally:
+        if options.trace != None:
+            try:
+                TRACER.Write(options.trace)
+            except (IOError, OSError), err:
+                if not options.quiet:
+                    print "[Warning] Cannot write trace file %s: %s" % (options.trace, str(err))
+            TRACER.Disable()
 
 
 if __name__ == '__main__':
@@ -4,21 +4,721 @@ Author: Wong Matthew Lun
 Date: 2015-12-08 6:21PM
 """
 import math
+import multiprocessing
 import os
+import threading
 import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
-import vtk
+import numpy as np
+
+import VTKModules as vtk
+from Tracing import TRACER
+from VTKModules import numpy_support
+
+# Version of the hole planning algorithm, bump when GetSemiUniDistnaceGrid changes its results so that plans
+# cached by older versions are no longer used
+PLAN_VERSION = 4
+
+# Serializes the background writes of WriteDebugPolyData()
+_debugWriteLock = threading.Lock()
+
+
+def NumpyToPolyData(m_points, m_connectivity, m_lines=False):
+    """
+    Create a polydata from a point array and a fixed size cell connectivity array.
+
+    :param m_points:        [numpy.ndarray] Nx3 array of point coordinates
+    :param m_connectivity:  [numpy.ndarray] MxK array of point ids of each cell
+    :param m_lines:         [bool] Cells are inserted as lines instead of polygons
+    :return: [vtkPolyData]
+    """
+    m_connectivity = np.asarray(m_connectivity).reshape(len(m_connectivity), -1)
+    m_cellArray = np.hstack([np.full((len(m_connectivity), 1), m_connectivity.shape[1]), m_connectivity]).ravel()
+
+    m_vtkPoints = vtk.vtkPoints()
+    m_vtkPoints.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(m_points), deep=1))
+    m_cells = vtk.vtkCellArray()
+    # The cell array is built here, so vtk can take it over without a copy
+    m_cells.SetCells(len(m_connectivity), numpy_support.numpy_to_vtkIdTypeArray(
+        m_cellArray.astype(numpy_support.ID_TYPE_CODE, copy=False), deep=0))
+
+    m_polydata = vtk.vtkPolyData()
+    m_polydata.SetPoints(m_vtkPoints)
+    if m_lines:
+        m_polydata.SetLines(m_cells)
+    else:
+        m_polydata.SetPolys(m_cells)
+    return m_polydata
+
+
+def PolyDataToArrays(m_polydata):
+    """
+    Return the points and the cell arrays of a polydata as a dictionary of arrays, see ArraysToPolyData().
+    Attributes of the points and cells are not included.
+
+    :param m_polydata:  [vtkPolyData]
+    :return: [dict] Name to array
+    """
+    m_arrays = {'points': numpy_support.vtk_to_numpy(m_polydata.GetPoints().GetData())}
+    for l_name, l_cells in [('verts', m_polydata.GetVerts()), ('lines', m_polydata.GetLines()),
+                            ('polys', m_polydata.GetPolys()), ('strips', m_polydata.GetStrips())]:
+        if l_cells.GetNumberOfCells() != 0:
+            m_arrays[l_name] = numpy_support.vtk_to_numpy(l_cells.GetData()).astype(numpy_support.ID_TYPE_CODE)
+            m_arrays[l_name + 'Count'] = np.array([l_cells.GetNumberOfCells()])
+    return m_arrays
+
+
+def ArraysToPolyData(m_arrays):
+    """
+    Create a polydata from the arrays of PolyDataToArrays(). The arrays are not copied, so memory-mapped arrays
+    stay on disk.
+
+    :param m_arrays:    [dict] Name to array
+    :return: [vtkPolyData]
+    """
+    m_points = vtk.vtkPoints()
+    m_points.SetData(numpy_support.numpy_to_vtk(m_arrays['points'], deep=0))
+    m_polydata = vtk.vtkPolyData()
+    m_polydata.SetPoints(m_points)
+    for l_name, l_setter in [('verts', m_polydata.SetVerts), ('lines', m_polydata.SetLines),
+                             ('polys', m_polydata.SetPolys), ('strips', m_polydata.SetStrips)]:
+        if l_name in m_arrays:
+            l_cells = vtk.vtkCellArray()
+            l_cells.SetCells(int(m_arrays[l_name + 'Count'][0]),
+                             numpy_support.numpy_to_vtkIdTypeArray(m_arrays[l_name], deep=0))
+            l_setter(l_cells)
+    return m_polydata
+
+
+def PolyDataToNumpy(m_polydata):
+    """
+    Return the points and the triangle connectivity of a polydata as arrays. Non-triangle polygons are
+    triangulated first.
+
+    :param m_polydata:  [vtkPolyData]
+    :return: [numpy.ndarray, numpy.ndarray] Nx3 array of points and Mx3 array of point ids
+    """
+    m_polys = numpy_support.vtk_to_numpy(m_polydata.GetPolys().GetData())
+    if len(m_polys) % 4 != 0 or np.any(m_polys[::4] != 3):
+        m_triangleFilter = vtk.vtkTriangleFilter()
+        m_triangleFilter.SetInputData(m_polydata)
+        m_triangleFilter.PassLinesOff()
+        m_triangleFilter.PassVertsOff()
+        m_triangleFilter.Update()
+        m_polys = numpy_support.vtk_to_numpy(m_triangleFilter.GetOutput().GetPolys().GetData())
+    m_points = numpy_support.vtk_to_numpy(m_polydata.GetPoints().GetData())
+    return m_points, m_polys.reshape(-1, 4)[:, 1:]
+
+
+def GetMaxEdgeLength(m_points, m_triangles):
+    """
+    Return the length of the longest triangle edge. Edges are measured one triangle side at a time to keep the
+    temporary arrays small.
+
+    :param m_points:    [numpy.ndarray] Nx3 array of points
+    :param m_triangles: [numpy.ndarray] Mx3 array of point ids
+    :return: [float] 0 if there are no triangles
+    """
+    if len(m_triangles) == 0:
+        return 0
+
+    m_maxEdge = 0
+    for k in xrange(3):
+        l_edges = m_points[m_triangles[:, k]] - m_points[m_triangles[:, k - 1]]
+        m_maxEdge = max(m_maxEdge, np.sqrt(np.sum(l_edges ** 2, axis=1)).max())
+    return m_maxEdge
+
+
+def SphereUnionDistance(m_points, m_centers, m_radius, m_binSize):
+    """
+    Evaluate the implicit function of a union of spheres, i.e. the distance to the nearest sphere center minus
+    the radius, at every point. Centers are hashed into bins of size m_binSize and each point only looks at the
+    centers in its own and the 26 neighbouring bins. Values are exact up to m_binSize - m_radius, points without
+    a center nearby get m_binSize - m_radius.
+
+    :param m_points:    [numpy.ndarray] Nx3 array of points
+    :param m_centers:   [list]  Coordinates of the sphere centers
+    :param m_radius:    [float] Radius of the spheres
+    :param m_binSize:   [float] Size of the hash bins, should be larger than m_radius
+    :return: [numpy.ndarray] Array of N signed distances, negative inside the spheres
+    """
+    m_points = np.asarray(m_points, dtype=float)
+    m_centers = np.asarray(m_centers, dtype=float).reshape(-1, 3)
+    m_distance = np.full(len(m_points), float(m_binSize))
+    if len(m_centers) == 0 or len(m_points) == 0:
+        return m_distance - m_radius
+
+    # Sort the points by bin so that each bin is a contiguous range
+    m_origin = np.minimum(m_points.min(axis=0), m_centers.min(axis=0)) - m_binSize
+    m_pointBins = np.floor((m_points - m_origin) / m_binSize).astype(np.int64)
+    m_dims = m_pointBins.max(axis=0) + 3
+    m_pointKeys = (m_pointBins[:, 0] * m_dims[1] + m_pointBins[:, 1]) * m_dims[2] + m_pointBins[:, 2]
+    m_order = np.argsort(m_pointKeys, kind='mergesort')
+    m_sortedKeys = m_pointKeys[m_order]
+
+    m_centerBins = np.floor((m_centers - m_origin) / m_binSize).astype(np.int64)
+    m_offsets = np.array([[i, j, k] for i in [-1, 0, 1] for j in [-1, 0, 1] for k in [-1, 0, 1]])
+    for l_center, l_bin in zip(m_centers, m_centerBins):
+        l_bins = l_bin + m_offsets
+        l_bins = l_bins[np.all((l_bins >= 0) & (l_bins < m_dims), axis=1)]
+        l_keys = (l_bins[:, 0] * m_dims[1] + l_bins[:, 1]) * m_dims[2] + l_bins[:, 2]
+        l_first = np.searchsorted(m_sortedKeys, l_keys, side='left')
+        l_last = np.searchsorted(m_sortedKeys, l_keys, side='right')
+        l_ids = np.concatenate([m_order[a:b] for a, b in zip(l_first, l_last)])
+        if len(l_ids) == 0:
+            continue
+        l_distance = np.sqrt(np.sum((m_points[l_ids] - l_center) ** 2, axis=1))
+        m_distance[l_ids] = np.minimum(m_distance[l_ids], l_distance)
+    return m_distance - m_radius
+
+
+def PolyLineSegments(m_polydata):
+    """
+    Return the line segments of the lines and polylines of a polydata. Points which are not part of any line
+    are returned as segments of zero length.
+
+    :param m_polydata:  [vtkPolyData]
+    :return: [numpy.ndarray, numpy.ndarray] Mx3 arrays of the start and end points of the segments
+    """
+    if m_polydata.GetNumberOfPoints() == 0:
+        return np.zeros([0, 3]), np.zeros([0, 3])
+    m_points = numpy_support.vtk_to_numpy(m_polydata.GetPoints().GetData()).astype(float)
+
+    m_starts = [np.zeros(0, dtype=int)]
+    m_ends = [np.zeros(0, dtype=int)]
+    if m_polydata.GetNumberOfLines() != 0:
+        m_cells = numpy_support.vtk_to_numpy(m_polydata.GetLines().GetData())
+        i = 0
+        while i < len(m_cells):
+            l_ids = m_cells[i + 1:i + 1 + m_cells[i]]
+            m_starts.append(l_ids[:-1])
+            m_ends.append(l_ids[1:])
+            i += m_cells[i] + 1
+    m_starts = np.concatenate(m_starts)
+    m_ends = np.concatenate(m_ends)
+
+    m_isolated = np.setdiff1d(np.arange(len(m_points)), np.concatenate([m_starts, m_ends]))
+    m_starts = np.concatenate([m_starts, m_isolated])
+    m_ends = np.concatenate([m_ends, m_isolated])
+    return m_points[m_starts], m_points[m_ends]
+
+
+def BuildSegmentLocator(m_starts, m_ends, m_reach, m_leafSize=16):
+    """
+    Group consecutive line segments into leaves of m_leafSize segments bounded by spheres and hash the leaves
+    into bins by their centers, see SegmentDistance(). Bins are sized so that every leaf within m_reach of a point
+    has its center in the bin of the point or one of the 26 neighbouring bins. The segments of a polyline should
+    be consecutive so that the leaves are compact.
+
+    :param m_starts:    [numpy.ndarray] Mx3 array of the start points of the segments
+    :param m_ends:      [numpy.ndarray] Mx3 array of the end points of the segments
+    :param m_reach:     [float] Distance up to which SegmentDistance() is exact
+    :param m_leafSize:  [int]   Number of segments of a leaf
+    :return: [dict]
+    """
+    m_starts = np.asarray(m_starts, dtype=float).reshape(-1, 3)
+    m_ends = np.asarray(m_ends, dtype=float).reshape(-1, 3)
+    m_locator = {'starts': m_starts,
+                 'ends': m_ends,
+                 'reach': float(m_reach)}
+    if len(m_starts) == 0:
+        m_locator['keys'] = np.zeros(0, dtype=np.int64)
+        return m_locator
+
+    # Sphere around the end points of each leaf, it holds all segments of the leaf
+    m_leafStarts = np.arange(0, len(m_starts), m_leafSize)
+    m_leafIds = np.arange(len(m_starts)) // m_leafSize
+    m_leafCounts = np.bincount(m_leafIds)
+    m_centers = (np.add.reduceat(m_starts, m_leafStarts) + np.add.reduceat(m_ends, m_leafStarts)) / \
+                (2. * m_leafCounts[:, np.newaxis])
+    m_radii = np.sqrt(np.maximum(np.sum((m_starts - m_centers[m_leafIds]) ** 2, axis=1),
+                                 np.sum((m_ends - m_centers[m_leafIds]) ** 2, axis=1)))
+    m_radii = np.maximum.reduceat(m_radii, m_leafStarts)
+
+    m_binSize = max(m_reach + m_radii.max(), 1e-6)
+    m_keys = BinKeys(np.floor(m_centers / m_binSize).astype(np.int64))
+    m_order = np.argsort(m_keys, kind='mergesort')
+    m_locator.update({'keys': m_keys[m_order],
+                      'leafStarts': m_leafStarts[m_order],
+                      'leafCounts': m_leafCounts[m_order],
+                      'centers': m_centers[m_order],
+                      'radii': m_radii[m_order],
+                      'binSize': m_binSize})
+    return m_locator
+
+
+def BinKeys(m_bins):
+    """
+    Return a single integer key of each bin of a locator, bins are limited to +/-2^20 along each axis
+
+    :param m_bins:  [numpy.ndarray] Nx3 integer bin coordinates
+    :return: [numpy.ndarray] N keys
+    """
+    m_bins = m_bins + 2 ** 20
+    return (m_bins[:, 0] << 42) | (m_bins[:, 1] << 21) | m_bins[:, 2]
+
+
+def GetBoundedPairs(m_points, m_locator):
+    """
+    Return the pairs of points and items of a locator of BuildSegmentLocator() or BuildTriangleLocator() which may
+    hold the item nearest to the point. Points are paired with the items in their own and the neighbouring bins,
+    an item has its geometry within its center distance plus its radius, or within its center distance if the
+    center lies on the item, and none closer than minus its radius. Items whose lower bound exceeds the upper
+    bound of another item, or the reach, are dropped.
+
+    :param m_points:    [numpy.ndarray] Nx3 array of points
+    :param m_locator:   [dict] Output of BuildSegmentLocator() or BuildTriangleLocator()
+    :return: [numpy.ndarray, numpy.ndarray] Point ids and item ids of the pairs
+    """
+    m_pointBins = np.floor(m_points / m_locator['binSize']).astype(np.int64)
+    m_offsets = np.array([[i, j, k] for i in [-1, 0, 1] for j in [-1, 0, 1] for k in [-1, 0, 1]])
+    m_centersOnItems = m_locator.get('centersOnItems', False)
+    m_upper = np.full(len(m_points), m_locator['reach'])
+    m_pointIds = []
+    m_itemIds = []
+    m_centerDistance = []
+    for l_offset in m_offsets:
+        l_keys = BinKeys(m_pointBins + l_offset)
+        l_first = np.searchsorted(m_locator['keys'], l_keys, side='left')
+        l_counts = np.searchsorted(m_locator['keys'], l_keys, side='right') - l_first
+        if l_counts.sum() == 0:
+            continue
+        l_pointIds = np.repeat(np.arange(len(m_points)), l_counts)
+        l_itemIds = np.arange(l_counts.sum()) - np.repeat(np.cumsum(l_counts) - l_counts - l_first, l_counts)
+        l_centerDistance = np.sqrt(np.sum((m_points[l_pointIds] - m_locator['centers'][l_itemIds]) ** 2, axis=1))
+
+        # Pairs of an offset are ordered by point, so the upper bound of each point is a segmented minimum
+        l_bound = l_centerDistance if m_centersOnItems else l_centerDistance + m_locator['radii'][l_itemIds]
+        l_paired = np.nonzero(l_counts)[0]
+        l_starts = (np.cumsum(l_counts) - l_counts)[l_paired]
+        m_upper[l_paired] = np.minimum(m_upper[l_paired], np.minimum.reduceat(l_bound, l_starts))
+        m_pointIds.append(l_pointIds)
+        m_itemIds.append(l_itemIds)
+        m_centerDistance.append(l_centerDistance)
+    if len(m_pointIds) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    m_pointIds = np.concatenate(m_pointIds)
+    m_itemIds = np.concatenate(m_itemIds)
+    m_centerDistance = np.concatenate(m_centerDistance)
+
+    m_keep = m_centerDistance - m_locator['radii'][m_itemIds] <= m_upper[m_pointIds]
+    return m_pointIds[m_keep], m_itemIds[m_keep]
+
+
+def SegmentDistance(m_points, m_locator):
+    """
+    Return the distance of every point to the nearest segment of a locator of BuildSegmentLocator(). All points
+    are queried at once: the leaves which may hold the nearest segment are found by GetBoundedPairs(), then the
+    exact distance is evaluated to their segments.
+    Distances are exact up to the reach of the locator, points without a segment within reach get the reach.
+
+    :param m_points:    [numpy.ndarray] Nx3 array of points
+    :param m_locator:   [dict] Output of BuildSegmentLocator()
+    :return: [numpy.ndarray] Array of N distances
+    """
+    m_points = np.asarray(m_points, dtype=float).reshape(-1, 3)
+    m_distance = np.full(len(m_points), m_locator['reach'])
+    if len(m_points) == 0 or len(m_locator['keys']) == 0:
+        return m_distance
+
+    m_pointIds, m_leafIds = GetBoundedPairs(m_points, m_locator)
+
+    # Exact distance to every segment of the remaining leaves, zero length segments are their start point
+    m_counts = m_locator['leafCounts'][m_leafIds]
+    m_segmentPointIds = np.repeat(m_pointIds, m_counts)
+    m_segmentIds = np.repeat(m_locator['leafStarts'][m_leafIds], m_counts) + \
+                   np.arange(m_counts.sum()) - np.repeat(np.cumsum(m_counts) - m_counts, m_counts)
+    m_starts = m_locator['starts'][m_segmentIds]
+    m_directions = m_locator['ends'][m_segmentIds] - m_starts
+    m_vectors = m_points[m_segmentPointIds] - m_starts
+    m_lengths2 = np.sum(m_directions ** 2, axis=1)
+    m_t = np.sum(m_vectors * m_directions, axis=1) / np.where(m_lengths2 > 0, m_lengths2, 1.)
+    m_t = np.clip(m_t, 0, 1)[:, np.newaxis]
+    np.minimum.at(m_distance, m_segmentPointIds, np.sqrt(np.sum((m_vectors - m_t * m_directions) ** 2, axis=1)))
+    return m_distance
+
+
+def BuildTriangleLocator(m_points, m_triangles, m_reach):
+    """
+    Hash triangles into bins by the centers of their bounding spheres, see ClosestPointOnSurface(). Bins are sized
+    so that every triangle within m_reach of a point has its center in the bin of the point or one of the 26
+    neighbouring bins.
+
+    :param m_points:    [numpy.ndarray] Nx3 array of points
+    :param m_triangles: [numpy.ndarray] Mx3 array of point ids
+    :param m_reach:     [float] Distance up to which ClosestPointOnSurface() is exact
+    :return: [dict]
+    """
+    m_corners = [np.asarray(m_points, dtype=float)[np.asarray(m_triangles)[:, k]] for k in xrange(3)]
+    m_locator = {'corners': m_corners,
+                 'reach': float(m_reach),
+                 'centersOnItems': True}
+    if len(m_triangles) == 0:
+        m_locator['keys'] = np.zeros(0, dtype=np.int64)
+        return m_locator
+
+    m_centers = (m_corners[0] + m_corners[1] + m_corners[2]) / 3.
+    m_radii = np.sqrt(np.max([np.sum((l_corner - m_centers) ** 2, axis=1) for l_corner in m_corners], axis=0))
+    m_binSize = max(m_reach + m_radii.max(), 1e-6)
+    m_keys = BinKeys(np.floor(m_centers / m_binSize).astype(np.int64))
+    m_order = np.argsort(m_keys, kind='mergesort')
+    m_locator.update({'keys': m_keys[m_order],
+                      'triangleIds': m_order,
+                      'centers': m_centers[m_order],
+                      'radii': m_radii[m_order],
+                      'binSize': m_binSize})
+    return m_locator
+
+
+def ClosestPointOnTriangles(m_points, m_a, m_b, m_c):
+    """
+    Return the closest point on each triangle (m_a, m_b, m_c) to the point of the same row, by the Voronoi regions
+    of the vertices, edges and face of the triangle.
+
+    :param m_points:    [numpy.ndarray] Nx3 array of points
+    :param m_a:         [numpy.ndarray] Nx3 array of the first corners of the triangles
+    :param m_b:         [numpy.ndarray] Nx3 array of the second corners of the triangles
+    :param m_c:         [numpy.ndarray] Nx3 array of the third corners of the triangles
+    :return: [numpy.ndarray] Nx3 array of closest points
+    """
+    m_ab = m_b - m_a
+    m_ac = m_c - m_a
+    m_ap = m_points - m_a
+    m_bp = m_points - m_b
+    m_cp = m_points - m_c
+    d1 = np.sum(m_ab * m_ap, axis=1)
+    d2 = np.sum(m_ac * m_ap, axis=1)
+    d3 = np.sum(m_ab * m_bp, axis=1)
+    d4 = np.sum(m_ac * m_bp, axis=1)
+    d5 = np.sum(m_ab * m_cp, axis=1)
+    d6 = np.sum(m_ac * m_cp, axis=1)
+    m_va = d3 * d6 - d5 * d4
+    m_vb = d5 * d2 - d1 * d6
+    m_vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Face region, then the edge and vertex regions override it, the vertices last as they take precedence
+        m_sum = m_va + m_vb + m_vc
+        m_closest = m_a + (m_ab * m_vb[:, np.newaxis] + m_ac * m_vc[:, np.newaxis]) / m_sum[:, np.newaxis]
+        l_mask = (m_va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        l_t = ((d4 - d3) / ((d4 - d3) + (d5 - d6)))[l_mask, np.newaxis]
+        m_closest[l_mask] = m_b[l_mask] + l_t * (m_c - m_b)[l_mask]
+        l_mask = (m_vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        m_closest[l_mask] = m_a[l_mask] + (d2 / (d2 - d6))[l_mask, np.newaxis] * m_ac[l_mask]
+        l_mask = (d6 >= 0) & (d5 <= d6)
+        m_closest[l_mask] = m_c[l_mask]
+        l_mask = (m_vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        m_closest[l_mask] = m_a[l_mask] + (d1 / (d1 - d3))[l_mask, np.newaxis] * m_ab[l_mask]
+        l_mask = (d3 >= 0) & (d4 <= d3)
+        m_closest[l_mask] = m_b[l_mask]
+        l_mask = (d1 <= 0) & (d2 <= 0)
+        m_closest[l_mask] = m_a[l_mask]
+    return m_closest
+
+
+def ClosestPointOnSurface(m_points, m_locator):
+    """
+    Return the closest point on the triangles of a locator of BuildTriangleLocator() to every point. All points
+    are queried at once: the triangles which may be nearest are found by GetBoundedPairs(), then the closest
+    point is evaluated on each of them. Results are exact for points within the reach of the locator, points
+    without a triangle within reach get NaN.
+
+    :param m_points:    [numpy.ndarray] Nx3 array of points
+    :param m_locator:   [dict] Output of BuildTriangleLocator()
+    :return: [numpy.ndarray, numpy.ndarray] Nx3 array of closest points and array of N distances
+    """
+    m_points = np.asarray(m_points, dtype=float).reshape(-1, 3)
+    m_closest = np.full(m_points.shape, np.nan)
+    m_distance = np.full(len(m_points), np.nan)
+    if len(m_points) == 0 or len(m_locator['keys']) == 0:
+        return m_closest, m_distance
+
+    m_pointIds, m_itemIds = GetBoundedPairs(m_points, m_locator)
+    if len(m_pointIds) == 0:
+        return m_closest, m_distance
+    m_triangleIds = m_locator['triangleIds'][m_itemIds]
+    m_pairClosest = ClosestPointOnTriangles(m_points[m_pointIds], *[l_corner[m_triangleIds] for l_corner in
+                                                                    m_locator['corners']])
+    m_pairDistance = np.sqrt(np.sum((m_pairClosest - m_points[m_pointIds]) ** 2, axis=1))
+    # Degenerate triangles have no face region, their NaN distances are never the nearest
+    m_pairDistance[np.isnan(m_pairDistance)] = np.inf
+
+    # Nearest triangle of each point, pairs are sorted by point then distance
+    m_order = np.lexsort((m_pairDistance, m_pointIds))
+    m_first = m_order[np.r_[True, m_pointIds[m_order][1:] != m_pointIds[m_order][:-1]]]
+    m_first = m_first[m_pairDistance[m_first] <= m_locator['reach']]
+    m_closest[m_pointIds[m_first]] = m_pairClosest[m_first]
+    m_distance[m_pointIds[m_first]] = m_pairDistance[m_first]
+    return m_closest, m_distance
+
+
+def WriteDebugPolyData(m_polydata, m_filename):
+    """
+    Write a polydata for debugging in a background thread, so that the caller can carry on, e.g. raise its
+    error, without waiting for the disk. The directory of m_filename is created if it does not exist.
+
+    :param m_polydata:  [vtkPolyData] Data to write, it should not be modified afterwards
+    :param m_filename:  [str] Output vtp file name
+    :return: [threading.Thread] The writing thread
+    """
+    def Write():
+        with _debugWriteLock:
+            m_directory = os.path.dirname(m_filename)
+            if m_directory != "" and not os.path.isdir(m_directory):  # Create path if not exist
+                os.makedirs(m_directory)
+            m_writer = vtk.vtkXMLPolyDataWriter()
+            m_writer.SetFileName(m_filename)
+            m_writer.SetInputData(m_polydata)
+            m_writer.Write()
+        pass
+
+    m_thread = threading.Thread(target=Write, name="DebugWriter")
+    m_thread.start()
+    return m_thread
+
+
+@TRACER.Traced("glyph")
+def CreateSphereGlyph(m_holelist, m_holeRadius):
+    """
+    Create a polydata holding a tessellated sphere at every hole.
+
+    :param m_holelist:      [list]  A list or HoleGrid of coordinates of the sphere centers
+    :param m_holeRadius:    [float] The radius of the spheres
+    :return: [vtkPolyData]
+    """
+    # Forms a polydata with the hole list
+    pts = vtk.vtkPoints()
+    pd = vtk.vtkPolyData()
+    pts.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(m_holelist, dtype=float).reshape(-1, 3), deep=0))
+    pd.SetPoints(pts)
+
+    # Use glyph to create spheres
+    sphereSource = vtk.vtkSphereSource()
+    sphereSource.SetPhiResolution(10)
+    sphereSource.SetThetaResolution(10)
+    sphereSource.SetRadius(m_holeRadius)
+    sphereSource.Update()
+    glyph = vtk.vtkGlyph3D()
+    glyph.SetInputData(pd)
+    glyph.SetSourceConnection(sphereSource.GetOutputPort())
+    glyph.Update()
+
+    # writer = vtk.vtkXMLPolyDataWriter()
+    # writer.SetInputData(glyph.GetOutput())
+    # writer.SetFileName("./Output/glyph.vtp")
+    # writer.Update()
+    # writer.Write()
+    return glyph.GetOutput()
+
+
+@TRACER.Traced("clip")
+def ClipSpheres(m_target, m_holelist, m_holeRadius, m_analytic=False):
+    """
+    Clip away the parts of a surface inside the spheres at the holes.
+
+    :param m_target:        [vtkPolyData] Surface to clip
+    :param m_holelist:      [list]  A list of coordinates where holes are to be drilled
+    :param m_holeRadius:    [float] The radius of the hole to drill
+    :param m_analytic:      [bool]  Clip against the analytic union of the spheres, see SphereUnionDistance(),
+                                    instead of the distance to a tessellated glyph of the spheres
+    :return: [vtkPolyData]
+    """
+    clipper = vtk.vtkClipPolyData()
+    if m_analytic:
+        # Clip by point scalars holding the signed distance to the nearest sphere, an edge can only cross a
+        # sphere if both its ends are within the radius plus the longest edge of the center
+        m_targetPoints, m_targetTriangles = PolyDataToNumpy(m_target)
+        m_binSize = m_holeRadius + GetMaxEdgeLength(m_targetPoints, m_targetTriangles)
+        m_distance = numpy_support.numpy_to_vtk(SphereUnionDistance(m_targetPoints, m_holelist, m_holeRadius,
+                                                                    m_binSize * 1.01), deep=1)
+        m_distance.SetName("HoleDistance")
+        m_scalarTarget = vtk.vtkPolyData()
+        m_scalarTarget.ShallowCopy(m_target)
+        m_scalarTarget.GetPointData().SetScalars(m_distance)
+
+        clipper.SetInputData(m_scalarTarget)
+        clipper.SetValue(0)
+        clipper.Update()
+        clipper.GetOutput().GetPointData().RemoveArray("HoleDistance")
+    else:
+        clipFunc = vtk.vtkImplicitPolyDataDistance()
+        clipFunc.SetInput(CreateSphereGlyph(m_holelist, m_holeRadius))
+
+        clipper.SetInputData(m_target)
+        clipper.SetClipFunction(clipFunc)
+        clipper.Update()
+    TRACER.Count("clip.inputCells", m_target.GetNumberOfCells())
+    TRACER.Count("clip.outputCells", clipper.GetOutput().GetNumberOfCells())
+    return clipper.GetOutput()
+
+
+def ClipSpheresBlock(m_args):
+    """
+    Worker process entry of the partitioned clip, see ArmSurfaceHandler.PartitionedClipSpheres()
+
+    :param m_args:  [tuple] Points, triangles, holes, hole radius and analytic flag of the block
+    :return: [numpy.ndarray, numpy.ndarray] Points and triangles of the clipped block
+    """
+    m_points, m_triangles, m_holelist, m_holeRadius, m_analytic = m_args
+    m_clipped = ClipSpheres(NumpyToPolyData(m_points, m_triangles), m_holelist, m_holeRadius, m_analytic)
+    m_points, m_triangles = PolyDataToNumpy(m_clipped)
+    return np.array(m_points), np.array(m_triangles)
+
+
+class HoleGrid(object):
+    def __init__(self, points, sliceIds, angles, openings=None):
+        """
+        Create a HoleGrid object, the array-backed result of ArmSurfaceHandler.GetSemiUniDistnaceGrid(). Holes
+        are stored in slice order. The object also behaves as the list of hole coordinates the grid used to be
+        returned as, so len(), indexing and iteration give [x, y, z] lists.
+
+        :param points:      [numpy.ndarray] Nx3 hole coordinates
+        :param sliceIds:    [numpy.ndarray] N slice index of each hole
+        :param angles:      [numpy.ndarray] N polar angle of each hole in its slice, in degrees
+        :param openings:    [list] Kx3 point arrays of the opening lines. Default to no opening lines
+        :return:
+        """
+        self._points = np.ascontiguousarray(points, dtype=float).reshape(-1, 3)
+        self._sliceIds = np.ascontiguousarray(sliceIds, dtype=int).reshape(-1)
+        self._angles = np.ascontiguousarray(angles, dtype=float).reshape(-1)
+        if openings == None:
+            openings = []
+        self._openings = [np.ascontiguousarray(l_opening, dtype=float).reshape(-1, 3) for l_opening in openings]
+
+    def GetPoints(self):
+        """
+        Return the hole coordinates, a view of the grid
+
+        :return: [numpy.ndarray] Nx3
+        """
+        return self._points
+
+    def GetSliceIds(self):
+        return self._sliceIds
+
+    def GetAngles(self):
+        return self._angles
+
+    def GetOpenings(self):
+        """
+        Return the points of the opening lines, the first through the zero angle of each slice and the second
+        through the second openings if there are two buffer zones.
+
+        :return: [list] Kx3 arrays
+        """
+        return self._openings
+
+    def GetSliceHoles(self, m_sliceId):
+        """
+        Return the hole coordinates of a slice, a view of the grid
+
+        :param m_sliceId:   [int] Slice index
+        :return: [numpy.ndarray] Mx3
+        """
+        m_first, m_last = np.searchsorted(self._sliceIds, [m_sliceId, m_sliceId + 1])
+        return self._points[m_first:m_last]
+
+    def GetVTKPoints(self):
+        """
+        Return the hole coordinates as vtkPoints sharing the memory of the grid
+
+        :return: [vtkPoints]
+        """
+        m_vtkPoints = vtk.vtkPoints()
+        m_vtkPoints.SetData(numpy_support.numpy_to_vtk(self._points, deep=0))
+        return m_vtkPoints
+
+    def GetOpeningLine(self):
+        """
+        Return the opening lines as a polydata with one polyline per non-empty opening
+
+        :return: [vtkPolyData]
+        """
+        m_openings = [l_opening for l_opening in self._openings if len(l_opening) != 0]
+        m_polydata = vtk.vtkPolyData()
+        m_polydata.SetPoints(vtk.vtkPoints())
+        m_polydata.SetLines(vtk.vtkCellArray())
+        if len(m_openings) == 0:
+            return m_polydata
+
+        m_cellArray = []
+        m_offset = 0
+        for l_opening in m_openings:
+            m_cellArray.append(np.concatenate([[len(l_opening)], np.arange(len(l_opening)) + m_offset]))
+            m_offset += len(l_opening)
+        m_cellArray = np.concatenate(m_cellArray).astype(numpy_support.ID_TYPE_CODE)
+
+        m_polydata.GetPoints().SetData(numpy_support.numpy_to_vtk(np.vstack(m_openings), deep=1))
+        m_polydata.GetLines().SetCells(len(m_openings), numpy_support.numpy_to_vtkIdTypeArray(m_cellArray, deep=1))
+        return m_polydata
+
+    def __len__(self):
+        return len(self._points)
+
+    def __getitem__(self, m_index):
+        return self._points[m_index].tolist()
+
+    def __iter__(self):
+        return iter(self._points.tolist())
+
+    def __array__(self, dtype=None):
+        if dtype == None:
+            return self._points
+        return self._points.astype(dtype, copy=False)
+
+
+# Surface searched by the forked workers of ArmSurfaceHandler.SearchSemiUniDistnaceGrid(), and the full surface
+# candidates failing on a level of detail are evaluated again on
+_searchSurface = None
+_searchFallback = None
+
+
+def EvaluatePlanCandidate(m_args):
+    """
+    Worker entry of the parameter search, see ArmSurfaceHandler.SearchSemiUniDistnaceGrid()
+
+    :param m_args:  [tuple] Arguments of GetSemiUniDistnaceGrid() and the number of threads
+    :return: [int] Number of holes of the plan, None if the plan failed
+    """
+    m_holePerSlice, m_numberOfSlice, m_errorTolerance, m_startPadding, m_endPadding, m_bufferDeg, m_twoBuffer, \
+        m_threads = m_args
+    m_gridArgs = (m_holePerSlice, m_numberOfSlice, m_errorTolerance, m_startPadding, m_endPadding, m_bufferDeg,
+                  m_twoBuffer)
+    try:
+        return len(_searchSurface.GetSemiUniDistnaceGrid(*m_gridArgs, m_threads=m_threads))
+    except (RuntimeError, ValueError):
+        if _searchFallback == None:
+            return None
+    TRACER.Count("lod.fallback")
+    try:
+        return len(_searchFallback.GetSemiUniDistnaceGrid(*m_gridArgs, m_threads=m_threads))
+    except (RuntimeError, ValueError):
+        return None
 
 
 class CenterLineHandler(vtk.vtkPolyData):
-    def __init__(self, filename):
+    def __init__(self, filename, tangentWindows=[(3, 1), (12, 3)], cache=None):
+        """
+        Create a CenterLine object
+
+        :param filename:        VTP file of the centerline
+        :param tangentWindows:  [list] (range, step) smoothing windows of the tangent fields computed during Read()
+        :param cache:           [AssetCache] Cache of the parsed and resampled centerline. Default to no cache
+        :return:
+        """
         self.filename = filename
+        self._cache = cache
         self._reader = None
-        self._renderer = vtk.vtkRenderer()
-        # self._renderWindow = vtk.vtkRenderWindow()
-        # self._renderWindowInteractor = vtk.vtkRenderWindowInteractor()
+        self._lazyRenderer = None
+        self._lazyActor = None
         self._IS_READ_FLAG = False
+        self._tangentWindows = list(tangentWindows)
+        self._tangentFields = {}
+        self._frames = {}
 
+    @TRACER.Traced("read")
     def Read(self, m_forceRead=False):
         """
         Initial step, should be performed before everything else starts, considering to add
@@ -35,14 +735,26 @@ class CenterLineHandler(vtk.vtkPolyData):
             m_reader = vtk.vtkXMLPolyDataReader()
         else:
             raise IOError("Input file for centerline is of incorrect format")
-        m_reader.SetFileName(self.filename)
-        m_reader.Update()
 
-        m_mapper = vtk.vtkPolyDataMapper()
-        m_mapper.SetInputConnection(m_reader.GetOutputPort())
+        # Skip parsing and resampling if the centerline is in the cache
+        m_cacheKey = None
+        m_cached = None
+        if self._cache != None:
+            m_cacheKey = self._cache.GetKey(self.filename, "centerline", 500)
+            m_cached = self._cache.Load(m_cacheKey)
+
+        if m_cached != None:
+            m_reader = None
+            m_rawData = ArraysToPolyData(dict((k[3:], v) for k, v in m_cached.items() if k.startswith('raw')))
+            m_data = ArraysToPolyData(dict((k, v) for k, v in m_cached.items() if not k.startswith('raw')))
+        else:
+            m_reader.SetFileName(self.filename)
+            m_reader.Update()
+            m_rawData = m_reader.GetOutput()
 
-        m_actor = vtk.vtkActor()
-        m_actor.SetMapper(m_mapper)
+        # Point an existing actor to the new data, otherwise it is created on first use of _actor
+        if self._lazyActor != None:
+            self._lazyActor.GetMapper().SetInputData(m_rawData)
 
         # Reconstruct centerline polydata
         # m_points = vtk.vtkPoints()
@@ -75,31 +787,79 @@ class CenterLineHandler(vtk.vtkPolyData):
         #     m_points.InsertNextPoint(m_rawEndMiddle)
 
         # Use spline filter to reconstruct the centerpolyline
-        m_rawData = m_reader.GetOutput()
-
-        spline = vtk.vtkCardinalSpline()
-        spline.SetLeftConstraint(2)
-        spline.SetLeftValue(0)
-        spline.SetRightConstraint(2)
-        spline.SetRightValue(0)
-
-        splineFilter = vtk.vtkSplineFilter()
-        splineFilter.SetSpline(spline)
-        splineFilter.SetInputData(m_rawData)
-        splineFilter.SetNumberOfSubdivisions(500)
-        splineFilter.Update()
+        if m_cached == None:
+            spline = vtk.vtkCardinalSpline()
+            spline.SetLeftConstraint(2)
+            spline.SetLeftValue(0)
+            spline.SetRightConstraint(2)
+            spline.SetRightValue(0)
+
+            splineFilter = vtk.vtkSplineFilter()
+            splineFilter.SetSpline(spline)
+            splineFilter.SetInputData(m_rawData)
+            splineFilter.SetNumberOfSubdivisions(500)
+            with TRACER.Span("spline"):
+                splineFilter.Update()
+
+            # Take over the arrays of the spline output, the filter is released on return
+            m_data = vtk.vtkPolyData()
+            m_data.ShallowCopy(splineFilter.GetOutput())
+
+            if m_cacheKey != None:
+                m_arrays = PolyDataToArrays(m_data)
+                m_arrays.update(dict(('raw' + k, v) for k, v in PolyDataToArrays(m_rawData).items()))
+                self._cache.Store(m_cacheKey, m_arrays)
+
+        # Cumulative arc-length table, m_arcLength[i] is the length of the centerline from point 0 to point i
+        m_pointsArray = numpy_support.vtk_to_numpy(m_data.GetPoints().GetData()).astype(float)
+        m_arcLength = np.zeros(len(m_pointsArray))
+        m_arcLength[1:] = np.cumsum(np.sqrt(np.sum(np.diff(m_pointsArray, axis=0) ** 2, axis=1)))
 
-        m_data = vtk.vtkPolyData()
-        m_data.DeepCopy(splineFilter.GetOutput())
-
-        self._actor = m_actor
         self._reader = m_reader
-        self._renderer.AddActor(m_actor)
         self._rawData = m_rawData
         self._data = m_data
+        self._pointsArray = m_pointsArray
+        self._arcLength = m_arcLength
+        self._tangentFields = {}
+        self._frames = {}
+        for l_range, l_step in self._tangentWindows:
+            self.GetTangentField(l_range, l_step)
         self._IS_READ_FLAG = True
         pass
 
+    @property
+    def _renderer(self):
+        """
+        Renderer holding the actor of the centerline, created on first use so that headless runs never load the
+        rendering modules.
+
+        :return: [vtkRenderer]
+        """
+        if self._lazyRenderer == None:
+            vtk.LoadRendering()
+            self._lazyRenderer = vtk.vtkRenderer()
+            if self._IS_READ_FLAG:
+                self._lazyRenderer.AddActor(self._actor)
+        return self._lazyRenderer
+
+    @property
+    def _actor(self):
+        """
+        Actor of the centerline, created on first use after Read()
+
+        :return: [vtkActor] or None if the centerline is not read yet
+        """
+        if self._lazyActor == None and self._IS_READ_FLAG:
+            vtk.LoadRendering()
+            m_mapper = vtk.vtkPolyDataMapper()
+            m_mapper.SetInputData(self._rawData)
+
+            self._lazyActor = vtk.vtkActor()
+            self._lazyActor.SetMapper(m_mapper)
+            if self._lazyRenderer != None:
+                self._lazyRenderer.AddActor(self._lazyActor)
+        return self._lazyActor
+
     def ShowInteractor(self):
         """
         Useless function, For Debug, will delete
@@ -122,6 +882,7 @@ class CenterLineHandler(vtk.vtkPolyData):
         :return:
         """
         if self._renderer.GetRenderWindow() == None:
+            self._renderWindow = vtk.vtkRenderWindow()
             self._renderWindow.AddRenderer(self._renderer)
 
         elif self._renderer.GetRenderWindow() != self._renderWindow:
@@ -167,6 +928,7 @@ class CenterLineHandler(vtk.vtkPolyData):
         :param m_ptId:      [int]   vtkID
         :return:
         """
+        vtk.LoadRendering()
         m_ptCoord = self.GetPoint(m_ptId)
         m_sphere = vtk.vtkSphereSource()
         m_sphere.SetCenter(m_ptCoord)
@@ -204,24 +966,42 @@ class CenterLineHandler(vtk.vtkPolyData):
         d = math.sqrt(sum([(m_p1[i] - m_p2[i]) ** 2 for i in xrange(3)]))
         return d
 
+    def GetTotalLength(self):
+        """
+        Return the arc length of the whole centerline.
+
+        Require sequence: Read()
+
+        :return: [float]
+        """
+        return self._arcLength[-1]
+
     def GetEqualDistanceIntervalsIndex(self, m_distance, m_startPadding=0, m_endPadding=0):
         """
         Return a list of index indicating the id of a roughly uni-distance points.
 
+        Require sequence: Read()
+
         :param m_distance:      [float] Distance between each segments
-        :param m_startingPoint: [int] Index of the user specified starting point. Default=0
+        :param m_startPadding:  [int] Number of points skipped at the start of the centerline. Default=0
+        :param m_endPadding:    [int] Number of points skipped at the end of the centerline. Default=0
         :return:
         """
         m_intevals = []
-        m_loopValue = 0
         m_startPadding = int(m_startPadding)
         m_endPadding = int(m_endPadding)
         m_intevals.append(m_startPadding + 1)
-        for i in xrange(m_startPadding, self._data.GetNumberOfPoints() - m_endPadding):
-            m_loopValue += self.GetDistance(i, i - 1)
-            if m_loopValue > m_distance:
-                m_intevals.append(i)
-                m_loopValue = 0
+
+        # Each interval ends at the first point whose arc length exceeds the previous interval by m_distance
+        m_stop = len(self._arcLength) - m_endPadding
+        l_base = max(m_startPadding - 1, 0)
+        while True:
+            l_next = int(np.searchsorted(self._arcLength, self._arcLength[l_base] + m_distance, side='right'))
+            l_next = max(l_next, l_base + 1, m_startPadding)
+            if l_next >= m_stop:
+                break
+            m_intevals.append(l_next)
+            l_base = l_next
         return m_intevals
 
     def PrintPoints(self):
@@ -252,44 +1032,176 @@ class CenterLineHandler(vtk.vtkPolyData):
 
         return outList
 
+    def GetTangentField(self, m_range=3, m_step=1):
+        """
+        Return the smoothed tangent of every centerline point as an Nx3 array. The tangent of point i is the
+        average of the normalized finite differences at i + k, k in xrange(-m_range, m_range + 1, m_step),
+        scaled by m_step. Indexes wrap around the ends of the centerline.
+
+        Fields are cached per (m_range, m_step) so each window is only computed once per Read().
+
+        Require sequence: Read()
+
+        :param m_range: [int] Half width of the smoothing window in number of points
+        :param m_step:  [int] Step between the finite differences in the window
+        :return: [numpy.ndarray] Nx3 array of tangents
+        """
+        m_key = (int(m_range), int(m_step))
+        if m_key in self._tangentFields:
+            return self._tangentFields[m_key]
+
+        # Normalized backward differences, the difference of point 0 is taken against the last point
+        m_diff = self._pointsArray - np.roll(self._pointsArray, 1, axis=0)
+        m_magnitude = np.sqrt(np.sum(m_diff ** 2, axis=1))
+        m_valid = m_magnitude != 0
+        m_unit = np.zeros_like(m_diff)
+        m_unit[m_valid] = m_diff[m_valid] / m_magnitude[m_valid, np.newaxis]
+
+        m_sum = np.zeros_like(m_unit)
+        m_count = np.zeros(len(m_unit))
+        for l_offset in xrange(-m_key[0], m_key[0] + 1, m_key[1]):
+            m_sum += np.roll(m_unit, -l_offset, axis=0)
+            m_count += np.roll(m_valid, -l_offset)
+        m_field = m_sum * m_key[1] / np.maximum(m_count, 1)[:, np.newaxis]
+
+        self._tangentFields[m_key] = m_field
+        return m_field
+
     def GetNormalizedTangent(self, m_pointID, range=3, step=1):
-        m_indexlist = [m_pointID + i for i in xrange(-range, range + 1, step)]
-        m_preAverage = [0, 0, 0]
-        m_loopFactor = 0
-        for i in m_indexlist:
-            l_n = [self._data.GetPoint(i % self._data.GetNumberOfPoints())[k] -
-                   self._data.GetPoint((i - 1) % self._data.GetNumberOfPoints())[k] for k in xrange(3)]
-            l_magnitude = math.sqrt(sum([l_n[k] ** 2 for k in xrange(3)]))
-            if l_magnitude == 0:
-                continue
-            else:
-                m_preAverage = [m_preAverage[k] + l_n[k] / l_magnitude for k in xrange(3)]
-                m_loopFactor += 1
-        m_preAverage = [m_preAverage[k] * step / float(m_loopFactor) for k in xrange(3)]
-        return m_preAverage
+        """
+        Return the smoothed tangent at the specified point, see GetTangentField()
+
+        Require sequence: Read()
+
+        :param m_pointID:   [int] vtkID of the centerline point
+        :param range:       [int] Half width of the smoothing window in number of points
+        :param step:        [int] Step between the finite differences in the window
+        :return: [x, y, z]
+        """
+        m_field = self.GetTangentField(range, step)
+        return m_field[m_pointID % len(m_field)].tolist()
+
+    def GetParallelTransportFrame(self, m_seedId, m_seedVector):
+        """
+        Return a rotation-minimizing (parallel transport) reference vector for every centerline point. The frame
+        is seeded at m_seedId with the component of m_seedVector perpendicular to the centerline and propagated
+        to both ends with the double reflection method, so it does not twist around the centerline.
+
+        Frames are cached per seed.
+
+        Require sequence: Read()
+
+        :param m_seedId:        [int]   vtkID of the centerline point where the frame is seeded
+        :param m_seedVector:    [x, y, z] Reference direction at the seed, e.g. opening marker - centerline point
+        :return: [numpy.ndarray] Nx3 array of unit reference vectors perpendicular to the centerline
+        """
+        m_key = (int(m_seedId), tuple(np.round(m_seedVector, 6)))
+        if m_key in self._frames:
+            return self._frames[m_key]
+
+        m_points = self._pointsArray
+        m_tangents = np.gradient(m_points, axis=0)
+        m_tangents /= np.maximum(np.sqrt(np.sum(m_tangents ** 2, axis=1)), 1e-12)[:, np.newaxis]
+
+        m_reference = np.asarray(m_seedVector, dtype=float)
+        m_reference = m_reference - np.dot(m_reference, m_tangents[m_seedId]) * m_tangents[m_seedId]
+        m_norm = np.sqrt(np.dot(m_reference, m_reference))
+        if m_norm == 0:
+            raise ValueError("Seed vector of the centerline frame is parallel to the centerline")
+
+        m_frame = np.zeros_like(m_points)
+        m_frame[m_seedId] = m_reference / m_norm
+        for l_direction in [1, -1]:
+            l_reference = m_frame[m_seedId]
+            for i in xrange(m_seedId + l_direction, len(m_points) if l_direction > 0 else -1, l_direction):
+                l_v1 = m_points[i] - m_points[i - l_direction]
+                l_c1 = np.dot(l_v1, l_v1)
+                if l_c1 != 0:
+                    l_referenceL = l_reference - (2. / l_c1) * np.dot(l_v1, l_reference) * l_v1
+                    l_tangentL = m_tangents[i - l_direction] - (2. / l_c1) * np.dot(l_v1, m_tangents[
+                        i - l_direction]) * l_v1
+                    l_v2 = m_tangents[i] - l_tangentL
+                    l_c2 = np.dot(l_v2, l_v2)
+                    if l_c2 != 0:
+                        l_referenceL = l_referenceL - (2. / l_c2) * np.dot(l_v2, l_referenceL) * l_v2
+                    l_reference = l_referenceL / np.sqrt(np.dot(l_referenceL, l_referenceL))
+                m_frame[i] = l_reference
+
+        self._frames[m_key] = m_frame
+        return m_frame
 
     def GetPoint(self, m_int):
         return self._data.GetPoint(m_int)
 
+    def GetPointsArray(self):
+        """
+        Return the points of the centerline as an Nx3 array sharing the memory of the vtk points
+        Require sequence: Read()
+
+        :return: [numpy.ndarray]
+        """
+        return numpy_support.vtk_to_numpy(self._data.GetPoints().GetData())
+
 
 class ArmSurfaceHandler(vtk.vtkPolyData):
-    def __init__(self, filename, centerline, openingMarker):
+    def __init__(self, filename, centerline, openingMarker, cache=None, planCache=None,
+                 ringCacheSize=64 * 1024 ** 2, ringTolerance=0.5, lean=False, singlePrecision=False):
         """
         Create an ArmSurface object
 
-        :param filename:    STL file of the casting
-        :param centerline:  Centerline Object of the casting
+        In lean mode filter outputs are handed over by shallow copies and released as soon as they are consumed.
+        The reader is dropped after Read() and the slicing index, point locator and slice rings are released
+        before drilling, see ReleaseMemory(), so they are rebuilt if needed again afterwards.
+
+        :param filename:        STL file of the casting
+        :param centerline:      Centerline Object of the casting
+        :param cache:           [AssetCache] Cache of the parsed surface. Default to no cache
+        :param planCache:       [AssetCache] Cache of the results of GetSemiUniDistnaceGrid(), should be created
+                                             with version=PLAN_VERSION. Default to no cache
+        :param ringCacheSize:   [int] Memory budget in bytes of the resampled slice rings kept in memory, 0 to
+                                      disable
+        :param ringTolerance:   [float] Maximum angle in degrees between neighbouring points of the resampled slice
+                                        rings seen from the slice center, see ResampleSliceRing()
+        :param lean:            [bool] Memory-lean mode
+        :param singlePrecision: [bool] Convert double precision surface points to float32, e.g. of VTP surfaces.
+                                       STL surfaces are single precision already
         :return:
         """
         self.filename = filename
+        self._lean = lean
+        self._singlePrecision = singlePrecision
+        self._cache = cache
+        self._planCache = planCache
+        self._storePlans = True
+        self._readMTime = None
         self._reader = None
-        self._renderer = vtk.vtkRenderer()
-        # self._renderWindow = vtk.vtkRenderWindow()
-        # self._renderWindowInteractor = vtk.vtkRenderWindowInteractor()
+        self._lazyRenderer = None
+        self._lazyActor = None
         self._IS_READ_FLAG = False
         self._openingMarker = openingMarker
         self._bufferAngle = 0
         self._bufferRegionList = []
+        self._bufferFileNames = []
+        self._bufferClearance = 20.
+        self._bufferLocator = None
+        self._cutIndex = {}
+        self._cutIndexMTime = None
+        self._pointLocator = None
+        self._pointLocatorMTime = None
+        self._cellLocator = None
+        self._cellLocatorMTime = None
+        self._triangleLocator = None
+        self._triangleLocatorMTime = None
+        self._levelsOfDetail = {}
+        self._levelsOfDetailMTime = None
+        self._ringCache = OrderedDict()
+        self._ringCacheSize = ringCacheSize
+        self._ringTolerance = ringTolerance
+        self._ringCacheUsage = 0
+        self._ringCacheMTime = None
+        self._ringCacheLock = threading.Lock()
+        self._relaxedSlices = []
+        self._holeGrid = None
 
         # Read Centerline if it is not read before assignment
         centerline.Read()
@@ -301,16 +1213,58 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
 
     def SetBufferPolyLines(self, filenames):
         filenames = filenames.split(';')
+        self._bufferFileNames.extend(filenames)
+        self._bufferLocator = None
         reader = vtk.vtkXMLPolyDataReader()
         for filename in filenames:
             self._bufferRegionList.append(vtk.vtkPolyData())
-            reader.SetFileName(filenames)
+            reader.SetFileName(filename)
             reader.Update()
             self._bufferRegionList[-1].DeepCopy(reader.GetOutput())
 
+    def SetBufferClearance(self, clearance):
+        """
+        Set the minimum distance of the holes to the buffer polylines, see SetBufferPolyLines()
+
+        :param clearance:   [float] Distance in mm
+        :return:
+        """
+        self._bufferClearance = float(clearance)
+        self._bufferLocator = None
+        pass
+
+    def GetBufferLocator(self):
+        """
+        Return the segment locator of the buffer polylines, see BuildSegmentLocator(). The locator is kept until
+        the buffer polylines or the clearance change, it is exact up to the clearance.
+
+        Require sequence: SetBufferPolyLines()
+
+        :return: [dict]
+        """
+        if self._bufferLocator == None:
+            m_segments = [PolyLineSegments(l_region) for l_region in self._bufferRegionList]
+            m_starts = np.vstack([np.zeros([0, 3])] + [l_starts for l_starts, l_ends in m_segments])
+            m_ends = np.vstack([np.zeros([0, 3])] + [l_ends for l_starts, l_ends in m_segments])
+            self._bufferLocator = BuildSegmentLocator(m_starts, m_ends, self._bufferClearance)
+        return self._bufferLocator
+
+    def GetBufferMask(self, m_points):
+        """
+        Return which points keep the clearance from the buffer polylines, the distance is measured to the
+        polyline segments
+
+        Require sequence: SetBufferPolyLines()
+
+        :param m_points:    [numpy.ndarray] Nx3 array of points
+        :return: [numpy.ndarray] Boolean mask, True where the point is at least the clearance away
+        """
+        return SegmentDistance(m_points, self.GetBufferLocator()) >= self._bufferClearance
+
     def IsRead(self):
         return self._IS_READ_FLAG
 
+    @TRACER.Traced("read")
     def Read(self, m_forceRead=False):
         """
         Initial step, should be performed before everything else starts, considering to add
@@ -328,22 +1282,80 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
             m_reader = vtk.vtkSTLReader()
         else:
             raise IOError("Input file for arm surface is of incorrect format")
-        m_reader.SetFileName(self.filename)
-        m_reader.Update()
 
-        m_mapper = vtk.vtkPolyDataMapper()
-        m_mapper.SetInputConnection(m_reader.GetOutputPort())
+        # Skip parsing if the surface is in the cache, only the geometry is cached
+        m_cacheKey = None
+        m_cached = None
+        if self._cache != None:
+            m_cacheKey = self._cache.GetKey(self.filename, "surface", m_reader.GetClassName(), self._singlePrecision)
+            m_cached = self._cache.Load(m_cacheKey)
 
-        m_actor = vtk.vtkActor()
-        m_actor.SetMapper(m_mapper)
+        if m_cached != None:
+            m_reader = None
+            m_data = ArraysToPolyData(m_cached)
+        else:
+            m_reader.SetFileName(self.filename)
+            m_reader.Update()
+            m_data = m_reader.GetOutput()
+
+            # STL points are single precision already, VTP surfaces may hold doubles. Converted before caching
+            # so the cached arrays are single precision too
+            m_pointsArray = numpy_support.vtk_to_numpy(m_data.GetPoints().GetData())
+            if self._singlePrecision and m_pointsArray.dtype != np.float32:
+                m_points = vtk.vtkPoints()
+                m_points.SetData(numpy_support.numpy_to_vtk(m_pointsArray.astype(np.float32), deep=0))
+                m_data.SetPoints(m_points)
+            if m_cacheKey != None:
+                self._cache.Store(m_cacheKey, PolyDataToArrays(m_data))
+            if self._lean:
+                # Keep only the arrays of the reader output
+                m_data = vtk.vtkPolyData()
+                m_data.ShallowCopy(m_reader.GetOutput())
+                m_reader = None
+
+        # Point an existing actor to the new data, otherwise it is created on first use of _actor
+        if self._lazyActor != None:
+            self._lazyActor.GetMapper().SetInputData(m_data)
 
-        self._actor = m_actor
         self._reader = m_reader
-        self._renderer.AddActor(m_actor)
-        self._data = m_reader.GetOutput()
+        self._data = m_data
+        self._readMTime = m_data.GetMTime()
         self._IS_READ_FLAG = True
         pass
 
+    @property
+    def _renderer(self):
+        """
+        Renderer holding the actor of the surface, created on first use so that headless runs never load the
+        rendering modules.
+
+        :return: [vtkRenderer]
+        """
+        if self._lazyRenderer == None:
+            vtk.LoadRendering()
+            self._lazyRenderer = vtk.vtkRenderer()
+            if self._IS_READ_FLAG:
+                self._lazyRenderer.AddActor(self._actor)
+        return self._lazyRenderer
+
+    @property
+    def _actor(self):
+        """
+        Actor of the surface, created on first use after Read()
+
+        :return: [vtkActor] or None if the surface is not read yet
+        """
+        if self._lazyActor == None and self._IS_READ_FLAG:
+            vtk.LoadRendering()
+            m_mapper = vtk.vtkPolyDataMapper()
+            m_mapper.SetInputData(self._data)
+
+            self._lazyActor = vtk.vtkActor()
+            self._lazyActor.SetMapper(m_mapper)
+            if self._lazyRenderer != None:
+                self._lazyRenderer.AddActor(self._lazyActor)
+        return self._lazyActor
+
     def GetPoint(self, m_int):
         """
         Return the coordinate of the vtkId point
@@ -353,6 +1365,16 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
         """
         return self._data.GetPoint(m_int)
 
+    def GetPointsArray(self):
+        """
+        Return the points of the surface as an Nx3 array sharing the memory of the vtk points, it is not valid
+        after the surface is drilled
+        Require sequence: Read()
+
+        :return: [numpy.ndarray]
+        """
+        return numpy_support.vtk_to_numpy(self._data.GetPoints().GetData())
+
     def SliceSurfaceOld(self, m_pt, m_normalVector, m_thickness=0.1):
         """
         Cut surface by checking dot product of the relative position vector from center line m_pt to
@@ -381,6 +1403,7 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
         m_vtkslicepoints.SetPoints(m_vtkpts)
         return m_vtkslicepoints
 
+    @TRACER.Traced("slicing")
     def SliceSurface(self, m_pt, m_normalVector):
         """
         Use vtkCutter to obtain a slice along the centerline direction
@@ -389,49 +1412,321 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
         :param m_normalVector:  [float, float, float] The normal vector of the cutting plane
         :return:
         """
+        m_ring = self.GetCachedSliceRing(m_pt, m_normalVector)
+        if m_ring != None:
+            return m_ring
+
         m_plane = vtk.vtkPlane()
         m_plane.SetOrigin(m_pt)
         m_plane.SetNormal(m_normalVector)
 
-        # create cutter
+        # create cutter, only cells straddling the plane are passed in
         m_cutter = vtk.vtkCutter()
         m_cutter.SetCutFunction(m_plane)
-        m_cutter.SetInputConnection(self._reader.GetOutputPort())
+        m_cutter.SetInputData(self.ExtractCutCells(m_normalVector, [m_pt]))
         m_cutter.Update()
 
-        for i in xrange(m_cutter.GetOutput().GetNumberOfPoints()):
-            l_ids = vtk.vtkIdList()
-            m_cutter.GetOutput().GetPointCells(i, l_ids)
-            if (l_ids.GetNumberOfIds() < 2):
-                if not os.path.isdir("./Debug/"):  # Create path if not exist
-                    os.mkdir("./Debug/")
-                writer = vtk.vtkXMLPolyDataWriter()
-                writer.SetFileName("./Debug/Error.vtp")
-                writer.SetInputData(m_cutter.GetOutput())
-                writer.Update()
-                writer.Write()
-                errFileDir = os.path.abspath("./Debug/Error.vtp")
-                raise RuntimeError("[Error] This is not a loop! Loop polyline saved to %s" % (errFileDir))
-
-        # Interpolate the slice before proceeding
-        spline = vtk.vtkCardinalSpline()
-        spline.SetLeftConstraint(2)
-        spline.SetLeftValue(0)
-        spline.SetRightConstraint(2)
-        spline.SetRightValue(0)
-
-        # So that the spline give a slice with arround N points
-        N = 1000
-        division = int(N / m_cutter.GetOutput().GetNumberOfPoints())
-
-        splineFilter = vtk.vtkSplineFilter()
-        splineFilter.SetSpline(spline)
-        splineFilter.SetInputData(m_cutter.GetOutput())
-        splineFilter.SetNumberOfSubdivisions(division)
-        splineFilter.Update()
-
-        m_vtkpoints = splineFilter.GetOutput()
-        return m_vtkpoints
+        m_ring = self.ResampleSliceRing(m_cutter.GetOutput(), m_pt)
+        self.CacheSliceRing(m_pt, m_normalVector, m_ring)
+        return m_ring
+
+    def GetSliceRingKey(self, m_pt, m_normalVector):
+        """
+        Return the key of a slice ring in the ring cache. The origin is quantized to 1e-4 and the unit normal to
+        1e-6 so that planes recomputed from the same centerline points share a key.
+
+        :param m_pt:            [x, y, z] A coordinate on the cutting plane
+        :param m_normalVector:  [x, y, z] Normal vector of the cutting plane
+        :return: [tuple]
+        """
+        m_normal = np.asarray(m_normalVector, dtype=float)
+        m_normal = m_normal / np.sqrt(np.dot(m_normal, m_normal))
+        return (tuple(np.round(np.asarray(m_pt, dtype=float) * 1e4).astype(int)),
+                tuple(np.round(m_normal * 1e6).astype(int)))
+
+    def GetCachedSliceRing(self, m_pt, m_normalVector):
+        """
+        Return the resampled slice ring of the plane if it is in the ring cache, otherwise None. The cache is
+        emptied when the surface is modified, e.g. after drilling.
+
+        :param m_pt:            [x, y, z] A coordinate on the cutting plane
+        :param m_normalVector:  [x, y, z] Normal vector of the cutting plane
+        :return: [vtkPolyData]
+        """
+        m_key = self.GetSliceRingKey(m_pt, m_normalVector)
+        with self._ringCacheLock:
+            if self._ringCacheMTime != self._data.GetMTime():
+                self._ringCache = OrderedDict()
+                self._ringCacheUsage = 0
+                self._ringCacheMTime = self._data.GetMTime()
+            if m_key not in self._ringCache:
+                TRACER.Count("ringCache.miss")
+                return None
+            TRACER.Count("ringCache.hit")
+            m_ring, m_size = self._ringCache.pop(m_key)
+            self._ringCache[m_key] = (m_ring, m_size)  # Mark as recently used
+        return m_ring
+
+    def CacheSliceRing(self, m_pt, m_normalVector, m_ring):
+        """
+        Keep a resampled slice ring in the ring cache, least recently used rings are dropped once the memory
+        budget is exceeded.
+
+        :param m_pt:            [x, y, z] A coordinate on the cutting plane
+        :param m_normalVector:  [x, y, z] Normal vector of the cutting plane
+        :param m_ring:          [vtkPolyData] Output of ResampleSliceRing()
+        :return:
+        """
+        m_size = m_ring.GetActualMemorySize() * 1024
+        if m_size > self._ringCacheSize:
+            return
+
+        m_key = self.GetSliceRingKey(m_pt, m_normalVector)
+        with self._ringCacheLock:
+            if self._ringCacheMTime != self._data.GetMTime():
+                self._ringCache = OrderedDict()
+                self._ringCacheUsage = 0
+                self._ringCacheMTime = self._data.GetMTime()
+            if m_key in self._ringCache:
+                self._ringCacheUsage -= self._ringCache.pop(m_key)[1]
+            self._ringCache[m_key] = (m_ring, m_size)
+            self._ringCacheUsage += m_size
+            while self._ringCacheUsage > self._ringCacheSize:
+                self._ringCacheUsage -= self._ringCache.popitem(last=False)[1][1]
+        pass
+
+    def ReleaseMemory(self):
+        """
+        Release the slicing index, the locators, the levels of detail and the slice rings, they are rebuilt on
+        next use
+
+        :return:
+        """
+        with self._ringCacheLock:
+            self._ringCache = OrderedDict()
+            self._ringCacheUsage = 0
+        self._cutIndex = {}
+        self._pointLocator = None
+        self._cellLocator = None
+        self._triangleLocator = None
+        self._levelsOfDetail = {}
+        pass
+
+    def GetTriangleArrays(self):
+        """
+        Return the points and the triangle connectivity of the surface as arrays. Non-triangle polygons are
+        triangulated first.
+
+        Require sequence: Read()
+
+        :return: [numpy.ndarray, numpy.ndarray] Nx3 array of points and Mx3 array of point ids
+        """
+        return PolyDataToNumpy(self._data)
+
+    def GetCutIndex(self, m_normalVector):
+        """
+        Return the sweep-line index of the surface cells along m_normalVector. The index holds the minimum and
+        maximum projection of every cell onto the normal, sorted by the minimum, so that the cells straddling a
+        plane can be found with a binary search. Indexes are cached per normal until the surface is modified.
+
+        Require sequence: Read()
+
+        :param m_normalVector:  [x, y, z] Normal vector of the cutting planes
+        :return: [dict]
+        """
+        m_normal = np.asarray(m_normalVector, dtype=float)
+        m_normal = m_normal / np.sqrt(np.dot(m_normal, m_normal))
+        m_key = tuple(np.round(m_normal, 6))
+
+        # Rebuild every index if the surface changed, e.g. after drilling
+        if self._cutIndexMTime != self._data.GetMTime():
+            self._cutIndex = {}
+            self._cutIndexMTime = self._data.GetMTime()
+        if m_key in self._cutIndex:
+            return self._cutIndex[m_key]
+
+        m_points, m_triangles = self.GetTriangleArrays()
+        m_cellProjection = np.dot(m_points, m_normal)[m_triangles]
+        m_cellMin = m_cellProjection.min(axis=1)
+        m_cellMax = m_cellProjection.max(axis=1)
+        m_order = np.argsort(m_cellMin, kind='mergesort')
+
+        m_index = {'normal': m_normal,
+                   'points': m_points,
+                   'triangles': m_triangles,
+                   'order': m_order,
+                   'min': m_cellMin[m_order],
+                   'max': m_cellMax[m_order],
+                   'extent': (m_cellMax - m_cellMin).max() if len(m_order) != 0 else 0}
+        self._cutIndex[m_key] = m_index
+        return m_index
+
+    def ExtractCutCells(self, m_normalVector, m_pts):
+        """
+        Return a polydata holding only the surface cells straddling any of the planes with normal m_normalVector
+        passing through m_pts.
+
+        Require sequence: Read()
+
+        :param m_normalVector:  [x, y, z] Normal vector of the cutting planes
+        :param m_pts:           [list]  Coordinates on each of the cutting planes
+        :return: [vtkPolyData]
+        """
+        m_index = self.GetCutIndex(m_normalVector)
+        m_values = np.dot(np.asarray(m_pts, dtype=float), m_index['normal'])
+        m_margin = 1e-6 * max(m_index['extent'], 1)
+
+        m_cells = []
+        for l_value in m_values:
+            l_first = np.searchsorted(m_index['min'], l_value - m_index['extent'] - m_margin, side='left')
+            l_last = np.searchsorted(m_index['min'], l_value + m_margin, side='right')
+            l_straddle = np.flatnonzero(m_index['max'][l_first:l_last] >= l_value - m_margin) + l_first
+            m_cells.append(m_index['order'][l_straddle])
+        m_cells = np.unique(np.concatenate(m_cells))
+
+        m_triangles = m_index['triangles'][m_cells]
+        m_ids, m_connectivity = np.unique(m_triangles, return_inverse=True)
+        return NumpyToPolyData(m_index['points'][m_ids], m_connectivity.reshape(-1, 3))
+
+    def SliceSurfaceMultiple(self, m_pts, m_normalVector):
+        """
+        Cut the surface with a set of parallel planes in a single traversal of the mesh, the planes share the
+        normal vector and each passes through one of m_pts. Each ring is resampled as in SliceSurface().
+
+        :param m_pts:           [list]  Coordinates on each of the desired cutting planes
+        :param m_normalVector:  [float, float, float] The normal vector shared by all cutting planes
+        :return: [list] List of vtkPolyData rings, in the order of m_pts
+        """
+        m_rings = [self.GetCachedSliceRing(l_pt, m_normalVector) for l_pt in m_pts]
+        m_missing = [i for i in xrange(len(m_pts)) if m_rings[i] == None]
+        if len(m_missing) == 0:
+            return m_rings
+
+        # Only cut the planes which are not in the ring cache
+        m_cuts = self.CutSurfaceMultiple([m_pts[i] for i in m_missing], m_normalVector)
+        for k in xrange(len(m_missing)):
+            m_rings[m_missing[k]] = self.ResampleSliceRing(m_cuts[k], m_pts[m_missing[k]])
+            self.CacheSliceRing(m_pts[m_missing[k]], m_normalVector, m_rings[m_missing[k]])
+        return m_rings
+
+    @TRACER.Traced("slicing")
+    def CutSurfaceMultiple(self, m_pts, m_normalVector):
+        """
+        Cut the surface with a set of parallel planes in a single traversal of the mesh and split the cutter
+        output into one raw ring per plane, see SliceSurfaceMultiple()
+
+        :param m_pts:           [list]  Coordinates on each of the desired cutting planes
+        :param m_normalVector:  [float, float, float] The normal vector shared by all cutting planes
+        :return: [list] List of vtkPolyData, in the order of m_pts
+        """
+        m_normal = np.asarray(m_normalVector, dtype=float)
+        m_normal = m_normal / np.sqrt(np.dot(m_normal, m_normal))
+        m_origin = np.asarray(m_pts[0], dtype=float)
+        m_values = np.dot(np.asarray(m_pts, dtype=float) - m_origin, m_normal)
+
+        m_plane = vtk.vtkPlane()
+        m_plane.SetOrigin(m_origin)
+        m_plane.SetNormal(m_normal)
+
+        # One contour value per plane, offset along the normal from the first plane
+        m_cutter = vtk.vtkCutter()
+        m_cutter.SetCutFunction(m_plane)
+        m_cutter.SetInputData(self.ExtractCutCells(m_normal, m_pts))
+        for k in xrange(len(m_values)):
+            m_cutter.SetValue(k, m_values[k])
+        m_cutter.Update()
+
+        return self.SplitSlices(m_cutter.GetOutput(), m_origin, m_normal, m_values)
+
+    def SplitSlices(self, m_cut, m_origin, m_normalVector, m_values):
+        """
+        Split the output of a multi-value vtkCutter into one polydata per contour value. Each point is assigned to
+        the nearest contour value and each line to the contour value of its first point.
+
+        :param m_cut:           [vtkPolyData] Output of a vtkCutter with a vtkPlane cut function
+        :param m_origin:        [x, y, z] Origin of the cut plane
+        :param m_normalVector:  [x, y, z] Unit normal of the cut plane
+        :param m_values:        [list]  Contour values of the cutter
+        :return: [list] List of vtkPolyData, in the order of m_values
+        """
+        m_values = np.asarray(m_values, dtype=float)
+        m_slices = []
+        if m_cut.GetNumberOfPoints() == 0:
+            return [vtk.vtkPolyData() for k in xrange(len(m_values))]
+
+        m_points = numpy_support.vtk_to_numpy(m_cut.GetPoints().GetData())
+        m_lines = numpy_support.vtk_to_numpy(m_cut.GetLines().GetData()).reshape(-1, 3)[:, 1:]
+        m_distance = np.dot(m_points - m_origin, m_normalVector)
+        m_pointSlice = np.argmin(np.abs(m_distance[:, np.newaxis] - m_values[np.newaxis, :]), axis=1)
+        m_lineSlice = m_pointSlice[m_lines[:, 0]]
+
+        for k in xrange(len(m_values)):
+            l_lines = m_lines[m_lineSlice == k]
+            l_ids, l_connectivity = np.unique(l_lines, return_inverse=True)
+            m_slices.append(NumpyToPolyData(m_points[l_ids], l_connectivity.reshape(-1, 2), m_lines=True))
+        return m_slices
+
+    @TRACER.Traced("spline")
+    def ResampleSliceRing(self, m_ring, m_center=None):
+        """
+        Check that a cut is a closed loop and subdivide its segments evenly so that neighbouring points are at most
+        the ring tolerance of the handler apart in angle seen from m_center. The spacing is the angle times the
+        distance of the nearest ring point to the center, so the number of points follows the perimeter of the
+        ring. Segments already shorter than the spacing are kept as they are.
+
+        :param m_ring:      [vtkPolyData] Output of a vtkCutter, made of two-point line segments
+        :param m_center:    [x, y, z] Center of the slice. Default to the spacing of a circle of the same perimeter
+        :return: [vtkPolyData]
+        """
+        m_segments = np.zeros([0, 2], dtype=int)
+        if m_ring.GetNumberOfLines() != 0:
+            m_segments = numpy_support.vtk_to_numpy(m_ring.GetLines().GetData()).reshape(-1, 3)[:, 1:]
+
+        # Every point of a closed loop is shared by at least two segments
+        m_valence = np.bincount(m_segments.ravel(), minlength=m_ring.GetNumberOfPoints())
+        if m_ring.GetNumberOfPoints() == 0 or np.any(m_valence < 2):
+            m_debugRing = vtk.vtkPolyData()
+            m_debugRing.DeepCopy(m_ring)
+            errFileDir = os.path.abspath("./Debug/Error.vtp")
+            WriteDebugPolyData(m_debugRing, errFileDir)
+            raise RuntimeError("[Error] This is not a loop! Loop polyline saved to %s" % (errFileDir))
+
+        m_points = numpy_support.vtk_to_numpy(m_ring.GetPoints().GetData())
+        m_start = m_points[m_segments[:, 0]].astype(float)
+        m_direction = m_points[m_segments[:, 1]] - m_start
+        m_lengths = np.sqrt(np.sum(m_direction ** 2, axis=1))
+
+        # Never sample finer than a quarter of the spacing of the circle of the same perimeter
+        m_radius = m_lengths.sum() / (2 * np.pi)
+        if m_center is not None:
+            m_centerDistance = np.sqrt(np.sum((m_points - np.asarray(m_center, dtype=float)) ** 2, axis=1))
+            m_radius = max(m_centerDistance.min(), m_radius / 4.)
+        m_spacing = m_radius * np.radians(self._ringTolerance)
+        m_divisions = np.maximum(np.ceil(m_lengths / m_spacing), 1).astype(int)
+
+        # Each segment becomes a chain of its start point, m_divisions - 1 new points and its end point
+        m_chainStarts = np.cumsum(m_divisions + 1) - (m_divisions + 1)
+        m_chainEnds = m_chainStarts + m_divisions
+        m_isNew = np.ones(m_chainEnds[-1] + 1, dtype=bool)
+        m_isNew[m_chainStarts] = False
+        m_isNew[m_chainEnds] = False
+        m_newSegments = np.repeat(np.arange(len(m_segments)), m_divisions - 1)
+        m_newSteps = np.nonzero(m_isNew)[0] - m_chainStarts[m_newSegments]
+        m_newPoints = m_start[m_newSegments] + m_direction[m_newSegments] * \
+                      (m_newSteps / m_divisions[m_newSegments].astype(float))[:, np.newaxis]
+
+        m_chain = np.empty(len(m_isNew), dtype=int)
+        m_chain[m_chainStarts] = m_segments[:, 0]
+        m_chain[m_chainEnds] = m_segments[:, 1]
+        m_chain[m_isNew] = len(m_points) + np.arange(len(m_newPoints))
+        m_links = np.ones(len(m_chain) - 1, dtype=bool)
+        m_links[m_chainEnds[:-1]] = False
+
+        m_resampled = NumpyToPolyData(np.vstack([m_points, m_newPoints.astype(m_points.dtype)]),
+                                      np.column_stack([m_chain[:-1], m_chain[1:]])[m_links], m_lines=True)
+        TRACER.Count("ring.points", m_ring.GetNumberOfPoints())
+        TRACER.Count("ring.resampledPoints", m_resampled.GetNumberOfPoints())
+        return m_resampled
 
     def SliceSurfaceCutter(self, m_pt, m_normalVector):
         """
@@ -445,20 +1740,190 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
         m_plane.SetOrigin(m_pt)
         m_plane.SetNormal(m_normalVector)
 
-        # create cutter
+        # create cutter, only cells straddling the plane are passed in
         m_cutter = vtk.vtkCutter()
         m_cutter.SetCutFunction(m_plane)
-        m_cutter.SetInputConnection(self._reader.GetOutputPort())
+        m_cutter.SetInputData(self.ExtractCutCells(m_normalVector, [m_pt]))
         m_cutter.Update()
 
         return m_cutter
 
+    @TRACER.Traced("alpha")
+    def FindRingAlphaVector(self, m_slice, m_sliceCenter, m_reference, m_normalVector):
+        """
+        Return the vector from the slice center to the ring point which lies closest to the direction of
+        m_reference projected onto the slice plane. The ring is scanned once with NumPy.
+
+        :param m_slice:         [vtkPolyData] Ring obtained from SliceSurface()
+        :param m_sliceCenter:   [x, y, z] Center of the slice on the centerline
+        :param m_reference:     [x, y, z] Zero angle reference direction, e.g. from the centerline frame
+        :param m_normalVector:  [x, y, z] Normal vector of the slice plane
+        :return: [x, y, z]
+        """
+        m_normal = np.asarray(m_normalVector, dtype=float)
+        m_normal = m_normal / np.sqrt(np.dot(m_normal, m_normal))
+        m_reference = np.asarray(m_reference, dtype=float)
+        m_reference = m_reference - np.dot(m_reference, m_normal) * m_normal
+
+        m_ringVects = numpy_support.vtk_to_numpy(m_slice.GetPoints().GetData()) - np.asarray(m_sliceCenter)
+        m_angles = np.arctan2(np.dot(np.cross(m_reference, m_ringVects), m_normal), np.dot(m_ringVects, m_reference))
+        return m_ringVects[np.argmin(np.abs(m_angles))].tolist()
+
+    @TRACER.Traced("alpha")
+    def SearchRingAlphaVector(self, m_slice, m_sliceCenter, m_ringAlphaVect, m_alphaNormal):
+        """
+        Legacy search of the zero angle ring point. Scan the ring for a point lying on the plane spanned by the
+        slice normal and m_ringAlphaVect, relaxing the accuracy until a point is found.
+
+        :param m_slice:             [vtkPolyData] Ring obtained from SliceSurface()
+        :param m_sliceCenter:       [x, y, z] Center of the slice on the centerline
+        :param m_ringAlphaVect:     [x, y, z] Vector from the centerline to the opening marker
+        :param m_alphaNormal:       [x, y, z] Normal of the plane where the zero angle ring point lies
+        :return: [x, y, z]
+        """
+        m_ringVects = numpy_support.vtk_to_numpy(m_slice.GetPoints().GetData()) - np.asarray(m_sliceCenter)
+        m_planeDistance = np.abs(np.dot(m_ringVects, m_alphaNormal))
+        m_sameSide = np.dot(m_ringVects, m_ringAlphaVect) > 0
+
+        # Define an initial accuracy which relax if no suitable points is found, the first ring point in order
+        # satisfying the accuracy is taken
+        m_loopAccuracy = 0.25
+        while m_loopAccuracy < 10:
+            TRACER.Count("alpha.iterations")
+            l_candidates = np.flatnonzero(m_sameSide & (m_planeDistance < m_loopAccuracy))
+            if len(l_candidates) != 0:
+                return m_ringVects[l_candidates[0]].tolist()
+            m_loopAccuracy *= 2
+        raise ValueError("Slice Alpha Vector search reaches maximum tolerance")
+
+    def GetRingHoleAngles(self, m_numberOfHoles, m_uniformSectionDegree, m_bufferDeg=0, m_twoBuffer=False):
+        """
+        Return the polar angles of the holes of a ring in the ideal grid, see PlaceRingHoles()
+
+        :param m_numberOfHoles:         [int]   Number of holes to place on the ring
+        :param m_uniformSectionDegree:  [float] Angle between neighbouring holes in degrees
+        :param m_bufferDeg:             [float] Angle of the buffer zone in degrees
+        :param m_twoBuffer:             [bool]  Open a second buffer zone half way round the ring
+        :return: [numpy.ndarray, numpy.ndarray] Angles of the holes and the angle of the second opening or None
+        """
+        m_targets = m_bufferDeg / 2. + m_uniformSectionDegree * np.arange(m_numberOfHoles)
+        m_openingTarget = None
+        if m_twoBuffer:
+            m_half = int((m_numberOfHoles + 1) / 2.)
+            m_openingTarget = np.array([m_targets[m_half - 1] + m_bufferDeg / 2.])
+            m_targets[m_half:] += m_bufferDeg - m_uniformSectionDegree
+        return m_targets, m_openingTarget
+
+    @TRACER.Traced("placement")
+    def PlaceRingHoles(self, m_slice, m_sliceCenter, m_ringAlphaVect, m_normalVector, m_numberOfHoles,
+                       m_uniformSectionDegree, m_bufferDeg=0, m_errorTolerance=1, m_twoBuffer=False,
+                       m_maxErrorTolerance=None):
+        """
+        Place holes on a slice ring at equal polar angles. Signed polar angles of the whole ring are computed in
+        one pass, measured counter-clockwise about m_normalVector from m_ringAlphaVect, and each hole is
+        interpolated on the sorted angle array. The first hole lies m_bufferDeg / 2 from the zero angle and the
+        following holes are m_uniformSectionDegree apart. If m_twoBuffer is set, a second opening is placed
+        m_bufferDeg / 2 after the hole half way round the ring and the next hole m_bufferDeg / 2 after it.
+
+        If a hole misses m_errorTolerance and m_maxErrorTolerance is given, the tolerance of the ring is relaxed to
+        the smallest one all holes meet, which is twice the largest angle between a hole and its nearest ring
+        point, as long as it does not exceed m_maxErrorTolerance.
+
+        :param m_slice:                 [vtkPolyData] Ring obtained from SliceSurface()
+        :param m_sliceCenter:           [x, y, z] Center of the slice on the centerline
+        :param m_ringAlphaVect:         [x, y, z] Vector from the slice center to the zero angle ring point
+        :param m_normalVector:          [x, y, z] Normal vector of the slice plane
+        :param m_numberOfHoles:         [int]   Number of holes to place on the ring
+        :param m_uniformSectionDegree:  [float] Angle between neighbouring holes in degrees
+        :param m_bufferDeg:             [float] Angle of the buffer zone in degrees
+        :param m_errorTolerance:        [float] The maximum allowed angle between a hole and its nearest ring point
+        :param m_twoBuffer:             [bool]  Open a second buffer zone half way round the ring
+        :param m_maxErrorTolerance:     [float] The maximum error tolerance the ring may be relaxed to. Default to
+                                                no relaxation
+        :return: [numpy.ndarray, list, float] Hole coordinates, the coordinate of the second opening or None and
+                                              the error tolerance the holes were placed with
+        """
+        m_normal = np.asarray(m_normalVector, dtype=float)
+        m_normal = m_normal / np.sqrt(np.dot(m_normal, m_normal))
+        m_ringPoints = numpy_support.vtk_to_numpy(m_slice.GetPoints().GetData()).astype(float)
+        m_ringVects = m_ringPoints - np.asarray(m_sliceCenter)
+        m_angles = np.degrees(np.arctan2(np.dot(np.cross(m_ringAlphaVect, m_ringVects), m_normal),
+                                         np.dot(m_ringVects, m_ringAlphaVect))) % 360.
+
+        # Sort the ring by angle and wrap the end samples around so that every target has two neighbours
+        m_order = np.argsort(m_angles)
+        m_sortedAngles = np.concatenate([[m_angles[m_order[-1]] - 360.], m_angles[m_order],
+                                         [m_angles[m_order[0]] + 360.]])
+        m_sortedPoints = np.vstack([m_ringPoints[m_order[-1:]], m_ringPoints[m_order], m_ringPoints[m_order[:1]]])
+
+        m_targets, m_openingTarget = self.GetRingHoleAngles(m_numberOfHoles, m_uniformSectionDegree, m_bufferDeg,
+                                                            m_twoBuffer)
+        m_allTargets = m_targets if m_openingTarget is None else np.concatenate([m_targets, m_openingTarget])
+        m_upper = np.clip(np.searchsorted(m_sortedAngles, m_allTargets), 1, len(m_sortedAngles) - 1)
+        m_lower = m_upper - 1
+        m_gap = m_sortedAngles[m_upper] - m_sortedAngles[m_lower]
+        m_error = np.minimum(np.abs(m_allTargets - m_sortedAngles[m_lower]),
+                             np.abs(m_sortedAngles[m_upper] - m_allTargets))
+
+        # Holes must lie closer than half the tolerance to a ring point
+        if np.any(m_error >= m_errorTolerance / 2.):
+            m_requiredTolerance = np.nextafter(2. * m_error.max(), np.inf)
+            if m_maxErrorTolerance == None or m_requiredTolerance > m_maxErrorTolerance:
+                raise RuntimeError("[Error] Current error tolerence setting is to low to produce anything.")
+            m_errorTolerance = float(m_requiredTolerance)
+            TRACER.Count("tolerance.relaxed", m_errorTolerance)
+
+        m_weight = np.where(m_gap > 0, (m_allTargets - m_sortedAngles[m_lower]) / np.where(m_gap > 0, m_gap, 1), 0)
+        m_points = m_sortedPoints[m_lower] + m_weight[:, np.newaxis] * (m_sortedPoints[m_upper] -
+                                                                        m_sortedPoints[m_lower])
+
+        m_holes = m_points[:len(m_targets)]
+        if m_openingTarget is None:
+            return m_holes, None, m_errorTolerance
+        return m_holes, m_points[-1].tolist(), m_errorTolerance
+
+    def GetSlicePlanes(self, m_numberOfSlice, m_startPadding=0, m_endPadding=0):
+        """
+        Return the centerline points the slices of GetSemiUniDistnaceGrid() pass through and the normal shared by
+        the slices.
+
+        :param m_numberOfSlice:     [int]   Desired number of slices
+        :param m_startPadding:      [int]   Starting side padding where no holes will be drilled
+        :param m_endPadding:        [int]   Ending side padding where no holes will be drilled
+        :return: [list, list] Centerline point ids of the slices and the average tangent
+        """
+        m_totalDistance = self._centerLine.GetTotalLength()
+
+        # Calculate some parameters
+        m_sliceSpacing = (m_totalDistance) / (m_numberOfSlice)
+        m_intervalIndexes = self._centerLine.GetEqualDistanceIntervalsIndex(m_sliceSpacing, m_startPadding,
+                                                                            m_endPadding)
+
+        m_tangents = self._centerLine.GetTangentField(12, 3)[m_intervalIndexes].tolist()
+
+        m_average = [sum([m_tangents[i][j] for i in xrange(3)]) / float(len(m_tangents)) for j in xrange(3)]
+        return m_intervalIndexes, m_average
+
+    @TRACER.Traced("plan")
     def GetSemiUniDistnaceGrid(self, m_holePerSlice, m_numberOfSlice, m_errorTolerance=1, m_startPadding=0,
-                               m_endPadding=0, m_bufferDeg=0, m_twoBuffer=False):
+                               m_endPadding=0, m_bufferDeg=0, m_twoBuffer=False, m_useFrame=True,
+                               m_batchSlicing=True, m_threads=1, m_maxErrorTolerance=None):
         """
         Obtain a set of coordinates roughly equal to a projection of periodic square grid vertex on the arm
         surface. The gird also can arbitrarily has a buffer zone where no holes are drilled.
 
+        The zero angle of each slice is looked up from the rotation-minimizing frame of the centerline seeded at
+        the opening marker. Set m_useFrame to False to use the legacy tolerance search instead.
+
+        If m_maxErrorTolerance is given, a slice whose holes miss m_errorTolerance has its own tolerance relaxed up
+        to m_maxErrorTolerance instead of failing the whole grid, see PlaceRingHoles(). The relaxed slices are
+        recorded in self._relaxedSlices as (slice index, tolerance) pairs.
+
+        :param m_useFrame:          [bool]  Use the centerline frame to locate the zero angle of each slice
+        :param m_batchSlicing:      [bool]  Cut all slices in a single pass over the surface
+        :param m_threads:           [int]   Number of threads processing the slices in parallel
+        :param m_maxErrorTolerance: [float] The maximum error tolerance a failing slice may be relaxed to. Default
+                                            to no relaxation
         :param m_twoBuffer:
         :param m_holePerSlice:      [int]   Desired number of holes per slice
         :param m_numberOfSlice:     [int]   Desired number of slices
@@ -466,7 +1931,7 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
         :param m_startPadding:      [int]   Starting side padding where no holes will be drilled
         :param m_endPadding:        [int]   Ending side padding where no holes will be drilled
         :param m_bufferDeg:         [float] Angle between planes where buffers zones are in between. Default to 40
-        :return: [list] List of hole coordinates
+        :return: [HoleGrid] Hole coordinates with their slice indexes and angles
         """
         vtkmath = vtk.vtkMath()
 
@@ -476,162 +1941,291 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
         if self._bufferAngle != None:
             m_bufferDeg = self._bufferAngle
 
-        m_totalDistance = 0
-        startMarker = None
-        endMarker = 0
-        for i in xrange(1, self._centerLine._data.GetNumberOfPoints()):
-            m_totalDistance += self._centerLine.GetDistance(i, i - 1)
-            if (m_totalDistance > m_startPadding and startMarker == None):
-                startMarker = i
-            while (self._centerLine.GetDistance(endMarker, i) > m_endPadding and endMarker < i):
-                endMarker += 1
-
-        # Calculate some parameters
-        m_sliceSpacing = (m_totalDistance) / (m_numberOfSlice)
-        m_intervalIndexes = self._centerLine.GetEqualDistanceIntervalsIndex(m_sliceSpacing, m_startPadding,
-                                                                            m_endPadding)
+        # Return the stored plan if the same inputs were planned before, only if the surface is not drilled yet
+        m_planKey = None
+        if self._planCache != None and self._data.GetMTime() == self._readMTime:
+            m_planKey = self._planCache.GetKey([self.filename, self._centerLine.filename] + self._bufferFileNames,
+                                               "plan", PLAN_VERSION, self._openingMarker, m_holePerSlice,
+                                               m_numberOfSlice, m_errorTolerance, m_startPadding, m_endPadding,
+                                               m_bufferDeg, m_twoBuffer, m_useFrame, m_maxErrorTolerance,
+                                               self._bufferClearance, self._ringTolerance)
+            m_plan = self._planCache.Load(m_planKey)
+            TRACER.Count("planCache.hit" if m_plan != None else "planCache.miss")
+            if m_plan != None:
+                self._centerLineIntervals = m_plan['intervals'].tolist()
+                self._averageTangent = m_plan['averageTangent'].tolist()
+                self._relaxedSlices = [(int(l_index), float(l_tolerance)) for l_index, l_tolerance in m_plan['relaxed']]
+                self._holeGrid = HoleGrid(m_plan['holes'], m_plan['sliceIds'], m_plan['angles'],
+                                          [m_plan['opening0'], m_plan['opening1']])
+                self._openingList = self._holeGrid.GetOpenings()
+                self._holeList = self._holeGrid
+                return self._holeGrid
+
+        m_intervalIndexes, m_average = self.GetSlicePlanes(m_numberOfSlice, m_startPadding, m_endPadding)
         self._centerLineIntervals = m_intervalIndexes
 
-        m_tangents = []
-        for k in xrange(len(m_intervalIndexes)):
-            m_tmp = self._centerLine.GetNormalizedTangent(m_intervalIndexes[k], range=12, step=3)
-            m_tangents.append(m_tmp)
-
-        m_average = [sum([m_tangents[i][j] for i in xrange(3)]) / float(len(m_tangents)) for j in xrange(3)]
-
         m_openingList = [[],[]]
-        m_holeList = []
         m_alphaNormal = None
-        m_masterPt = self._centerLine.GetPoint(m_intervalIndexes[0])
+        m_masterPtId = m_intervalIndexes[0]
+        m_masterPt = self._centerLine.GetPoint(m_masterPtId)
 
         # Define cast opening zone and start drilling zone
-        noDrillKdTree = None
+        m_noDrill = len(self._bufferRegionList) != 0
         if m_bufferDeg != None and self._openingMarker != None:
             m_kdtree = vtk.vtkKdTreePointLocator()
             m_kdtree.SetDataSet(self._centerLine._data)
             m_kdtree.BuildLocator()
             m_closestCenterlinePointId = m_kdtree.FindClosestPoint(self._openingMarker)
             m_closestCenterlinePoint = self._centerLine.GetPoint(m_closestCenterlinePointId)
+            m_masterPtId = m_closestCenterlinePointId
             m_masterPt = m_closestCenterlinePoint
-        elif len(self._bufferRegionList) != 0:  # create a pd specifying no hole drilling
-            appendPD = vtk.vtkAppendPolyData()
-            for pds in self._bufferRegionList:
-                appendPD.AddInputData(pds)
-            appendPD.Update()
-            noDrillKdTree = vtk.vtkKdTree()
-            noDrillKdTree.BuildLocatorFromPoints(appendPD.GetOutput())
-
-        # Drill along intervals
-        for i in xrange(len(m_intervalIndexes)):
-            l_sliceCenter = self._centerLine.GetPoint(m_intervalIndexes[i])
-            l_slice = self.SliceSurface(l_sliceCenter, m_average)
-
-            # writer = vtk.vtkXMLPolyDataWriter()
-            # writer.SetInputData(l_slice)
-            # writer.SetFileName("./Output/Slice%02i.vtp"%i)
-            # writer.Update()
-            # writer.Write()
-
-            # Define the starting vector for all slice
-            if i == 0:
-                # l_ringAlphaPt = l_slice.GetPoint(i)
-                l_ringAlphaVect = [self._openingMarker[j] - m_masterPt[j] for j in xrange(3)]
-                m_alphaNormal = [0, 0, 0]
-                vtkmath.Cross(m_average, l_ringAlphaVect, m_alphaNormal)
-                m_alphaNormalMag = sum([m_alphaNormal[k] for k in xrange(3)])
-                m_alphaNormal = [m_alphaNormal[k] / m_alphaNormalMag for k in xrange(3)]
-
-            # Define an initial accuracy which relax if no suitable points is found, affects calculation speed
-            m_loopAccuracy = 0.25
-            m_ringSliceAlphaVect = None
-            while m_ringSliceAlphaVect == None:
-                for j in xrange(l_slice.GetNumberOfPoints()):
-                    l_ringSliceAlphaVect = [l_slice.GetPoint(j)[k] - l_sliceCenter[k] for k in xrange(3)]
-                    # l_ringSliceMasterVect = [l_slice.GetPoint(j)[k] - m_masterPt[k] for k in xrange(3)]
-                    if math.fabs(vtkmath.Dot(l_ringSliceAlphaVect, m_alphaNormal)) < m_loopAccuracy and vtkmath.Dot(
-                            l_ringSliceAlphaVect, l_ringAlphaVect) > 0:
-                        m_ringSliceAlphaVect = l_ringSliceAlphaVect
-                        break
-                m_loopAccuracy *= 2
-                if m_loopAccuracy >= 10:
-                    raise ValueError("Slice Alpha Vector search reaches maximum tolerance")
-                    break
 
-            if (noDrillKdTree != None):  # if supplied noDrill region polydata, the section degree isdifferent
-                l_uniformSectionDegree = (360.) / (m_holePerSlice - 1)
-                l_sectionDegree = 0
-            elif m_twoBuffer: # if twoSides options is on
-                l_uniformSectionDegree = (360. - m_bufferDeg * 2) / (m_holePerSlice - 3)
-                l_sectionDegree = 0
+        # Define the starting vector for all slice
+        l_ringAlphaVect = [self._openingMarker[j] - m_masterPt[j] for j in xrange(3)]
+        m_alphaNormal = [0, 0, 0]
+        vtkmath.Cross(m_average, l_ringAlphaVect, m_alphaNormal)
+        m_alphaNormalMag = sum([m_alphaNormal[k] for k in xrange(3)])
+        m_alphaNormal = [m_alphaNormal[k] / m_alphaNormalMag for k in xrange(3)]
+        if m_useFrame:
+            m_frame = self._centerLine.GetParallelTransportFrame(m_masterPtId, l_ringAlphaVect)
+
+        if m_noDrill:  # if supplied noDrill region polydata, the section degree isdifferent
+            m_uniformSectionDegree = (360.) / (m_holePerSlice - 1)
+        elif m_twoBuffer: # if twoSides options is on
+            m_uniformSectionDegree = (360. - m_bufferDeg * 2) / (m_holePerSlice - 3)
+        else:
+            m_uniformSectionDegree = (360. - m_bufferDeg) / (m_holePerSlice - 2)
+
+        # Cut all slices missing from the ring cache at once if batch slicing is on, otherwise build the cut index
+        # before the workers start
+        m_sliceCenters = [self._centerLine.GetPoint(m_intervalIndexes[i]) for i in xrange(len(m_intervalIndexes))]
+        m_rings = [self.GetCachedSliceRing(l_center, m_average) for l_center in m_sliceCenters]
+        m_missing = [i for i in xrange(len(m_rings)) if m_rings[i] == None]
+        if len(m_missing) != 0 and m_batchSlicing:
+            m_cuts = dict(zip(m_missing, self.CutSurfaceMultiple([m_sliceCenters[i] for i in m_missing], m_average)))
+        elif len(m_missing) != 0:
+            self.GetCutIndex(m_average)
+
+        def ProcessSlice(i):
+            l_sliceCenter = m_sliceCenters[i]
+            l_slice = m_rings[i]
+            if l_slice == None and m_batchSlicing:
+                l_slice = self.ResampleSliceRing(m_cuts[i], l_sliceCenter)
+                self.CacheSliceRing(l_sliceCenter, m_average, l_slice)
+            elif l_slice == None:
+                l_slice = self.SliceSurface(l_sliceCenter, m_average)
+
+            if m_useFrame:
+                l_ringSliceAlphaVect = self.FindRingAlphaVector(l_slice, l_sliceCenter,
+                                                                m_frame[m_intervalIndexes[i]], m_average)
             else:
-                l_uniformSectionDegree = (360. - m_bufferDeg) / (m_holePerSlice - 2)
-                l_sectionDegree = 0
-
-            SECOND_BUFFER_FLAG = False
-            l_loopbreak = 0
-            m_openingList[0].append(
-                [l_ringSliceAlphaVect[k] + l_sliceCenter[k] for k in xrange(3)])  # Include first vector
-            l_holeList = []
-            while (len(l_holeList) < m_holePerSlice - 1):
-                if len(l_holeList) == 0:
-                    l_sectionDegree = m_bufferDeg / 2
-
-                # open another gap at half way
-                if (m_twoBuffer):
-                    if len(l_holeList) == int(m_holePerSlice / 2.):
-                        l_sectionDegree = m_bufferDeg / 2.
-
-                j = 0
-                while j < l_slice.GetNumberOfPoints():
-                    l_p1 = [0., 0., 0.]
-                    l_ringVect = [l_slice.GetPoint(j)[k] - l_sliceCenter[k] for k in xrange(3)]
-                    vtkmath.Cross(l_ringSliceAlphaVect, l_ringVect, l_p1)
-                    l_p2 = vtkmath.Dot(l_p1, m_average)
-                    l_angleBetweenRunningAndInitialVector = vtkmath.AngleBetweenVectors(l_ringSliceAlphaVect,
-                                                                                        l_ringVect)
-
-                    # if the inner lies within the tolerated range, push the point into the list
-                    if l_angleBetweenRunningAndInitialVector > vtkmath.RadiansFromDegrees(
-                                    l_sectionDegree - m_errorTolerance / 2) and l_angleBetweenRunningAndInitialVector < vtkmath.RadiansFromDegrees(
-                                l_sectionDegree + m_errorTolerance / 2.) and l_p2 > 0:
-                        l_ringSliceAlphaVect = l_ringVect
-
-                        if (m_twoBuffer and len(l_holeList) == int(m_holePerSlice / 2.) and not SECOND_BUFFER_FLAG):
-                            m_openingList[1].append([l_ringVect[k] + l_sliceCenter[k] for k in xrange(3)])
-                            l_sectionDegree = m_bufferDeg / 2.
-                            j = 0
-                            SECOND_BUFFER_FLAG = True
-                            continue;
-
-                        l_holeList.append([l_ringVect[k] + l_sliceCenter[k] for k in xrange(3)])
-                        l_sectionDegree += (
-                            l_uniformSectionDegree - vtkmath.DegreesFromRadians(l_angleBetweenRunningAndInitialVector))
-                        break
-                    j += 1
-
-                if l_loopbreak == m_holePerSlice:
-                    raise RuntimeError("[Error] Current error tolerence setting is to low to produce anything.")
-                l_loopbreak += 1
-            m_holeList.extend(l_holeList)
-            self._openingList = m_openingList
-
-        # check the hole list if kdtree != None, meaning there are no drill region specified
-        # then rebuild the hole list
-        if (noDrillKdTree != None):
-            tempList = []
-            for pt in m_holeList:
-                dist = vtk.mutable()
-                noDrillKdTree.FindClosestPoint(pt, dist)
-                if (dist < 20):
-                    continue
-                else:
-                    tempList.append(pt)
-                tempList.append(tempSubList)
-            m_holeList = tempList
+                l_ringSliceAlphaVect = self.SearchRingAlphaVector(l_slice, l_sliceCenter, l_ringAlphaVect,
+                                                                  m_alphaNormal)
+
+            l_holeList, l_secondOpening, l_tolerance = self.PlaceRingHoles(l_slice, l_sliceCenter,
+                                                                           l_ringSliceAlphaVect, m_average,
+                                                                           m_holePerSlice - 1,
+                                                                           m_uniformSectionDegree, m_bufferDeg,
+                                                                           m_errorTolerance, m_twoBuffer,
+                                                                           m_maxErrorTolerance)
+            l_alphaPoint = [l_ringSliceAlphaVect[k] + l_sliceCenter[k] for k in xrange(3)]
+            return l_alphaPoint, l_holeList, l_secondOpening, l_tolerance
+
+        # Drill along intervals, slices are independent once the alpha reference is defined
+        if m_threads > 1:
+            m_pool = ThreadPool(m_threads)
+            try:
+                m_results = m_pool.map(ProcessSlice, xrange(len(m_intervalIndexes)))
+            finally:
+                m_pool.terminate()
+                m_pool.join()
+        else:
+            m_results = map(ProcessSlice, xrange(len(m_intervalIndexes)))
+
+        # Merge back in slice order
+        m_relaxedSlices = []
+        for i, (l_alphaPoint, l_holeList, l_secondOpening, l_tolerance) in enumerate(m_results):
+            m_openingList[0].append(l_alphaPoint)  # Include first vector
+            if l_secondOpening != None:
+                m_openingList[1].append(l_secondOpening)
+            if l_tolerance != m_errorTolerance:
+                m_relaxedSlices.append((i, l_tolerance))
+        self._relaxedSlices = m_relaxedSlices
+
+        # Every slice places the same number of holes at the same target angles
+        m_angles = self.GetRingHoleAngles(m_holePerSlice - 1, m_uniformSectionDegree, m_bufferDeg, m_twoBuffer)[0]
+        m_holes = np.vstack([l_result[1] for l_result in m_results]).reshape(-1, 3)
+        m_sliceIds = np.repeat(np.arange(len(m_results)), len(m_angles))
+        m_angles = np.tile(m_angles, len(m_results))
+
+        # Drop the holes within the clearance of the no drill region polylines
+        if m_noDrill:
+            m_keep = self.GetBufferMask(m_holes)
+            TRACER.Count("buffer.droppedHoles", len(m_keep) - np.count_nonzero(m_keep))
+            m_holes, m_sliceIds, m_angles = m_holes[m_keep], m_sliceIds[m_keep], m_angles[m_keep]
 
         self._averageTangent = m_average
-        self._holeList = m_holeList
-        return m_holeList
+        self._holeGrid = HoleGrid(m_holes, m_sliceIds, m_angles, m_openingList)
+        self._openingList = self._holeGrid.GetOpenings()
+        self._holeList = self._holeGrid
+
+        if m_planKey != None and self._storePlans:
+            self._planCache.Store(m_planKey, {'intervals': np.array(m_intervalIndexes, dtype=int),
+                                              'opening0': self._holeGrid.GetOpenings()[0],
+                                              'opening1': self._holeGrid.GetOpenings()[1],
+                                              'averageTangent': np.array(m_average, dtype=float),
+                                              'relaxed': np.array(m_relaxedSlices, dtype=float).reshape(-1, 2),
+                                              'holes': self._holeGrid.GetPoints(),
+                                              'sliceIds': self._holeGrid.GetSliceIds(),
+                                              'angles': self._holeGrid.GetAngles()})
+        return self._holeGrid
+
+    def GetSurfaceArea(self):
+        """
+        Return the area of the surface
+
+        Require sequence: Read()
+
+        :return: [float]
+        """
+        m_mass = vtk.vtkMassProperties()
+        m_mass.SetInputData(self._data)
+        m_mass.Update()
+        return m_mass.GetSurfaceArea()
+
+    def GetMeanRadius(self, m_samples=5000):
+        """
+        Estimate the mean distance of the surface to the centerline from a subsample of the surface points.
+
+        :param m_samples:   [int] Maximum number of surface points sampled
+        :return: [float]
+        """
+        m_points = self.GetPointsArray()
+        m_points = m_points[::max(len(m_points) // m_samples, 1)].astype(float)
+        m_centerline = self._centerLine._pointsArray
+        m_distance = np.empty(len(m_points))
+        for l_start in xrange(0, len(m_points), 1000):
+            l_block = m_points[l_start:l_start + 1000]
+            l_squared = np.sum((l_block[:, np.newaxis, :] - m_centerline[np.newaxis, :, :]) ** 2, axis=2)
+            m_distance[l_start:l_start + 1000] = np.sqrt(l_squared.min(axis=1))
+        return float(m_distance.mean())
+
+    @TRACER.Traced("search")
+    def SearchSemiUniDistnaceGrid(self, m_targetDensity, m_holeRadius, m_tolerances=[1, 2, 4, 8], m_startPadding=0,
+                                  m_endPadding=0, m_bufferDeg=0, m_twoBuffer=False, m_processes=1, m_threads=1,
+                                  m_reduction=None):
+        """
+        Search the number of holes per slice, the number of slices and the error tolerance for a plan of
+        GetSemiUniDistnaceGrid() with at least m_targetDensity holes per cm^2 of surface. Candidates are tried
+        from the fewest holes up, the search stops at the first plan which succeeds and meets the density. The
+        grid of the found parameters is computed again so that the state of the object matches a direct call.
+
+        With m_reduction the candidates are planned on a level of detail, see GetCoarseSemiUniDistnaceGrid(). A
+        candidate failing on the level of detail is evaluated again on this surface, and the density is always
+        measured on this surface.
+
+        Candidates are bounded so that neighbouring holes of the grid do not overlap. Candidates are evaluated in
+        waves, the slice rings of a wave are cut once before its workers are forked so that they share them. Only
+        the plan found is stored in the plan cache, the plans of the other candidates are not.
+
+        Require sequence: Read()
+
+        :param m_targetDensity:     [float] Minimum number of holes per cm^2 of the surface
+        :param m_holeRadius:        [float] The radius of the holes
+        :param m_tolerances:        [list]  Error tolerances to try, in degrees
+        :param m_processes:         [int]   Number of worker processes evaluating candidates
+        :param m_threads:           [int]   Number of threads processing the slices of a candidate
+        :param m_reduction:         [float] Fraction of the cells removed by the level of detail the candidates
+                                            are planned on. Default to planning on this surface
+        :return: [HoleGrid, tuple] Hole coordinates and the (m_holePerSlice, m_numberOfSlice,
+                                   m_errorTolerance) found
+        """
+        global _searchSurface, _searchFallback
+
+        m_planner = self
+        if m_reduction != None:
+            m_planner = self.GetLevelOfDetail(m_reduction)
+
+        m_area = self.GetSurfaceArea() / 100.
+        m_maxSlices = int(self._centerLine.GetTotalLength() / (2 * m_holeRadius))
+        m_maxHoles = int(2 * math.pi * self.GetMeanRadius() / (2 * m_holeRadius))
+
+        # Slice planes of every slice count, counts giving fewer than three slice planes raise IndexError and are skipped
+        m_slicePlanes = {}
+        for l_slices in xrange(2, m_maxSlices):
+            try:
+                m_slicePlanes[l_slices] = self.GetSlicePlanes(l_slices, m_startPadding, m_endPadding)
+            except IndexError:
+                continue
+
+        # Candidates meeting the density if every slice gets its holes, the fewest holes first
+        m_candidates = []
+        for l_holes in xrange(4, m_maxHoles + 2):
+            for l_slices in m_slicePlanes.keys():
+                if (l_holes - 1) * len(m_slicePlanes[l_slices][0]) < m_targetDensity * m_area:
+                    continue
+                for l_tolerance in sorted(m_tolerances):
+                    m_candidates.append((l_holes, l_slices, l_tolerance))
+        m_candidates.sort(key=lambda c: ((c[0] - 1) * len(m_slicePlanes[c[1]][0]), c[2], c[1]))
+
+        # Evaluate in waves, the slice rings of a wave are cut before its workers are forked so they share them
+        m_waveSize = max(m_processes, 1) * 4
+        m_sliced = set()
+        m_found = None
+        if len(self._bufferRegionList) != 0:
+            self.GetBufferLocator()  # Built once and shared with the workers
+        _searchSurface = m_planner
+        if m_planner is not self:
+            _searchFallback = self
+        self._storePlans = False  # Only the plan found is stored in the plan cache
+        try:
+            for l_first in xrange(0, len(m_candidates), m_waveSize):
+                l_wave = m_candidates[l_first:l_first + m_waveSize]
+                for l_slices in sorted(set([c[1] for c in l_wave]) - m_sliced):
+                    l_intervals, l_average = m_slicePlanes[l_slices]
+                    try:
+                        m_planner.SliceSurfaceMultiple([self._centerLine.GetPoint(i) for i in l_intervals],
+                                                       l_average)
+                    except RuntimeError:
+                        pass
+                    m_sliced.add(l_slices)
+
+                l_jobs = [(l_holes, l_slices, l_tolerance, m_startPadding, m_endPadding, m_bufferDeg, m_twoBuffer,
+                           m_threads) for l_holes, l_slices, l_tolerance in l_wave]
+                if m_processes > 1 and len(l_jobs) > 1:
+                    l_pool = multiprocessing.Pool(min(m_processes, len(l_jobs)))
+                    l_results = l_pool.imap(EvaluatePlanCandidate, l_jobs)
+                else:
+                    l_pool = None
+                    l_results = (EvaluatePlanCandidate(l_job) for l_job in l_jobs)
+
+                # Results come back in the order of the candidates, the rest are dropped at the first success
+                try:
+                    for k, l_numberOfHoles in enumerate(l_results):
+                        TRACER.Count("search.candidates")
+                        if l_numberOfHoles != None and l_numberOfHoles >= m_targetDensity * m_area:
+                            m_found = l_wave[k]
+                            break
+                finally:
+                    if l_pool != None:
+                        l_pool.terminate()
+                        l_pool.join()
+                if m_found != None:
+                    break
+        finally:
+            _searchSurface = None
+            _searchFallback = None
+            self._storePlans = True
+
+        if m_found == None:
+            raise RuntimeError("[Error] No plan with %.3f holes per cm^2 found, please lower the density or set "
+                               "larger error tolerance" % (m_targetDensity))
+        m_gridArgs = (m_found[0], m_found[1], m_found[2], m_startPadding, m_endPadding, m_bufferDeg, m_twoBuffer)
+        if m_reduction != None:
+            m_holeList = self.GetCoarseSemiUniDistnaceGrid(m_reduction, *m_gridArgs, m_threads=m_threads)
+        else:
+            m_holeList = self.GetSemiUniDistnaceGrid(*m_gridArgs, m_threads=m_threads)
+        return m_holeList, m_found
 
     def GetPointActor(self, m_ptId, m_radius=1, m_color=[0.5, 0.5, 0]):
         """
@@ -642,6 +2236,7 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
         :param m_ptId:      [int]   vtkID
         :return:
         """
+        vtk.LoadRendering()
         m_ptCoord = self.GetPoint(m_ptId)
         m_sphere = vtk.vtkSphereSource()
         m_sphere.SetCenter(m_ptCoord)
@@ -666,6 +2261,7 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
         :return:
         """
         if self._renderer.GetRenderWindow() == None:
+            self._renderWindow = vtk.vtkRenderWindow()
             self._renderWindow.AddRenderer(self._renderer)
 
         elif self._renderer.GetRenderWindow() != self._renderWindow:
@@ -692,80 +2288,386 @@ class ArmSurfaceHandler(vtk.vtkPolyData):
 
         pass
 
-    def SphereDrill(self, m_holelist, m_holeRadius, m_quiet=False):
+    def GetPointLocator(self):
+        """
+        Return a point locator of the surface, the locator is rebuilt when the surface is modified.
+
+        Require sequence: Read()
+
+        :return: [vtkKdTreePointLocator]
+        """
+        if self._pointLocator == None or self._pointLocatorMTime != self._data.GetMTime():
+            self._pointLocator = vtk.vtkKdTreePointLocator()
+            self._pointLocator.SetDataSet(self._data)
+            self._pointLocator.BuildLocator()
+            self._pointLocatorMTime = self._data.GetMTime()
+        return self._pointLocator
+
+    def GetCellLocator(self):
+        """
+        Return a cell locator of the surface, the locator is rebuilt when the surface is modified.
+
+        Require sequence: Read()
+
+        :return: [vtkCellLocator]
+        """
+        if self._cellLocator == None or self._cellLocatorMTime != self._data.GetMTime():
+            self._cellLocator = vtk.vtkCellLocator()
+            self._cellLocator.SetDataSet(self._data)
+            self._cellLocator.BuildLocator()
+            self._cellLocatorMTime = self._data.GetMTime()
+        return self._cellLocator
+
+    def GetTriangleLocator(self):
+        """
+        Return a triangle locator of the surface, see BuildTriangleLocator(). Its reach is the longest edge of the
+        surface, the locator is rebuilt when the surface is modified.
+
+        Require sequence: Read()
+
+        :return: [dict]
+        """
+        if self._triangleLocator == None or self._triangleLocatorMTime != self._data.GetMTime():
+            m_points, m_triangles = self.GetTriangleArrays()
+            self._triangleLocator = BuildTriangleLocator(m_points, m_triangles,
+                                                         GetMaxEdgeLength(m_points, m_triangles))
+            self._triangleLocatorMTime = self._data.GetMTime()
+        return self._triangleLocator
+
+    def SnapToSurface(self, m_points):
+        """
+        Return the closest points on the surface of a set of points. All points are snapped in one batched query
+        of the triangle locator, see ClosestPointOnSurface(). The few points further than its reach from the
+        surface, i.e. further than the longest edge, are looked up in the cell locator one at a time and counted as
+        snap.fallback; holes planned on a level of detail lie within that reach, so the fallback is not expected to run.
+
+        Require sequence: Read()
+
+        :param m_points:    [numpy.ndarray] Nx3 array of points
+        :return: [numpy.ndarray] Nx3 array of points on the surface
+        """
+        m_points = np.asarray(m_points, dtype=float).reshape(-1, 3)
+        m_snapped, m_distance = ClosestPointOnSurface(m_points, self.GetTriangleLocator())
+
+        m_far = np.nonzero(np.isnan(m_distance))[0]
+        if len(m_far) != 0:
+            TRACER.Count("snap.fallback", len(m_far))
+            m_locator = self.GetCellLocator()
+            l_closest = [0., 0., 0.]
+            l_cellId = vtk.mutable(0)
+            l_subId = vtk.mutable(0)
+            l_distance = vtk.mutable(0.)
+            for i in m_far:
+                m_locator.FindClosestPoint(m_points[i].tolist(), l_closest, l_cellId, l_subId, l_distance)
+                m_snapped[i] = l_closest
+        return m_snapped
+
+    def GetLevelOfDetail(self, m_reduction):
+        """
+        Return a handler of the surface decimated by vtkDecimatePro, sharing the centerline, the opening marker and
+        the buffer zones of this surface. Up to m_reduction of the cells are removed while the topology is kept, so
+        slices of the level stay closed loops as on the surface. Levels are kept until the surface is modified,
+        the level of the surface as read is also stored in the asset cache.
+
+        Require sequence: Read()
+
+        :param m_reduction: [float] Fraction of the cells to remove, between 0 and 1
+        :return: [ArmSurfaceHandler]
+        """
+        if self._levelsOfDetailMTime != self._data.GetMTime():
+            self._levelsOfDetail = {}
+            self._levelsOfDetailMTime = self._data.GetMTime()
+        if m_reduction in self._levelsOfDetail:
+            return self._ShareBufferZones(self._levelsOfDetail[m_reduction])
+
+        m_cacheKey = None
+        m_cached = None
+        if self._cache != None and self._data.GetMTime() == self._readMTime:
+            m_cacheKey = self._cache.GetKey(self.filename, "levelOfDetail", "vtkDecimatePro", m_reduction)
+            m_cached = self._cache.Load(m_cacheKey)
+
+        if m_cached != None:
+            m_data = ArraysToPolyData(m_cached)
+        else:
+            with TRACER.Span("decimate"):
+                # Neither split the surface nor move its open ends, they bound the padding of the slices
+                m_decimate = vtk.vtkDecimatePro()
+                m_decimate.SetInputData(self._data)
+                m_decimate.SetTargetReduction(m_reduction)
+                m_decimate.PreserveTopologyOn()
+                m_decimate.BoundaryVertexDeletionOff()
+                m_decimate.Update()
+                m_data = vtk.vtkPolyData()
+                m_data.ShallowCopy(m_decimate.GetOutput())
+            if m_cacheKey != None:
+                self._cache.Store(m_cacheKey, PolyDataToArrays(m_data))
+        TRACER.Count("lod.cells", m_data.GetNumberOfCells())
+
+        m_level = ArmSurfaceHandler(self.filename, self._centerLine, self._openingMarker,
+                                    ringCacheSize=self._ringCacheSize, ringTolerance=self._ringTolerance)
+        m_level._data = m_data
+        m_level._readMTime = m_data.GetMTime()
+        m_level._IS_READ_FLAG = True
+        self._levelsOfDetail[m_reduction] = m_level
+        return self._ShareBufferZones(m_level)
+
+    def _ShareBufferZones(self, m_level):
+        """
+        Give a level of detail the current buffer zones of this surface. Called on every GetLevelOfDetail() so a
+        kept level never plans with buffer settings changed since it was made.
+
+        :param m_level: [ArmSurfaceHandler] Level of detail of this surface
+        :return: [ArmSurfaceHandler] m_level
+        """
+        m_level._bufferAngle = self._bufferAngle
+        m_level._bufferRegionList = self._bufferRegionList
+        m_level._bufferFileNames = self._bufferFileNames
+        m_level._bufferClearance = self._bufferClearance
+        m_level._bufferLocator = None
+        if len(self._bufferRegionList) != 0:
+            m_level._bufferLocator = self.GetBufferLocator()
+        return m_level
+
+    @TRACER.Traced("snap")
+    def SnapHoleGrid(self, m_holeGrid):
+        """
+        Snap the holes and the opening lines of a grid planned on a level of detail onto this surface, all points
+        go through a single SnapToSurface() call. The snapped grid becomes the grid of this surface as if planned
+        on it.
+
+        Require sequence: Read()
+
+        :param m_holeGrid:  [HoleGrid] Grid planned on a level of detail, see GetLevelOfDetail()
+        :return: [HoleGrid]
+        """
+        m_parts = [m_holeGrid.GetPoints()] + m_holeGrid.GetOpenings()
+        m_snapped = self.SnapToSurface(np.vstack(m_parts))
+        m_snapped = np.split(m_snapped, np.cumsum([len(l_part) for l_part in m_parts])[:-1])
+
+        self._holeGrid = HoleGrid(m_snapped[0], m_holeGrid.GetSliceIds(), m_holeGrid.GetAngles(), m_snapped[1:])
+        self._openingList = self._holeGrid.GetOpenings()
+        self._holeList = self._holeGrid
+        return self._holeGrid
+
+    def GetCoarseSemiUniDistnaceGrid(self, m_reduction, *args, **kwargs):
+        """
+        Plan the grid of GetSemiUniDistnaceGrid() on a level of detail of the surface, see GetLevelOfDetail(), then
+        snap it onto this surface, see SnapHoleGrid(). Arguments after m_reduction are passed to
+        GetSemiUniDistnaceGrid(). The decimation keeps the topology so slices of the level of detail stay closed
+        loops; a plan still failing on it, which did not happen on the test arms at reductions of 0.5 to 0.9, is
+        planned again on this surface and counted as lod.fallback.
+
+        Require sequence: Read()
+
+        :param m_reduction: [float] Fraction of the cells removed by the level of detail
+        :return: [HoleGrid]
+        """
+        m_level = self.GetLevelOfDetail(m_reduction)
+        try:
+            m_holeGrid = m_level.GetSemiUniDistnaceGrid(*args, **kwargs)
+        except (RuntimeError, ValueError):
+            TRACER.Count("lod.fallback")
+            return self.GetSemiUniDistnaceGrid(*args, **kwargs)
+        self._centerLineIntervals = m_level._centerLineIntervals
+        self._averageTangent = m_level._averageTangent
+        self._relaxedSlices = m_level._relaxedSlices
+        return self.SnapHoleGrid(m_holeGrid)
+
+    def GetDrillRegion(self, m_holelist, m_holeRadius, m_margin=None):
+        """
+        Return a mask of the surface cells having a point within m_holeRadius + m_margin of any hole. A cell cut by
+        a hole always has a point within the hole radius plus its longest edge of the hole center, which is the
+        default margin.
+
+        Require sequence: Read()
+
+        :param m_holelist:      [list]  A list of coordinates where holes are to be drilled
+        :param m_holeRadius:    [float] The radius of the hole to drill
+        :param m_margin:        [float] Extra distance around the holes. Default to the longest cell edge
+        :return: [numpy.ndarray] Boolean mask of the cells of GetTriangleArrays()
+        """
+        m_points, m_triangles = self.GetTriangleArrays()
+        if m_margin == None:
+            m_margin = GetMaxEdgeLength(m_points, m_triangles)
+
+        m_locator = self.GetPointLocator()
+        m_nearPoints = np.zeros(len(m_points), dtype=bool)
+        l_ids = vtk.vtkIdList()
+        for l_hole in m_holelist:
+            m_locator.FindPointsWithinRadius(m_holeRadius + m_margin, l_hole, l_ids)
+            m_nearPoints[[l_ids.GetId(k) for k in xrange(l_ids.GetNumberOfIds())]] = True
+        return np.any(m_nearPoints[m_triangles], axis=1)
+
+    def MergeDrillRegion(self, m_clipped, m_cellMask):
+        """
+        Stitch the clipped drill region back onto the cells outside the region. Points of the clipped region which
+        are original surface points are merged with them, points removed by the clip are dropped.
+
+        Require sequence: Read()
+
+        :param m_clipped:   [vtkPolyData] Clipped drill region
+        :param m_cellMask:  [numpy.ndarray] Boolean mask of the drill region cells, see GetDrillRegion()
+        :return: [vtkPolyData]
+        """
+        m_points, m_triangles = self.GetTriangleArrays()
+        m_regionIds = np.unique(m_triangles[m_cellMask])
+        m_lookup = dict(zip(map(tuple, m_points[m_regionIds].tolist()), m_regionIds))
+
+        m_clippedPoints, m_clippedTriangles = PolyDataToNumpy(m_clipped)
+        m_clippedPoints = m_clippedPoints.astype(m_points.dtype)
+
+        # Original points keep their ids, new points on the hole boundaries are appended
+        m_ids = np.array([m_lookup.get(p, -1) for p in map(tuple, m_clippedPoints.tolist())], dtype=int)
+        m_new = m_ids < 0
+        m_ids[m_new] = len(m_points) + np.arange(np.count_nonzero(m_new))
+
+        m_allPoints = np.vstack([m_points, m_clippedPoints[m_new]])
+        m_allTriangles = np.vstack([m_triangles[~m_cellMask], m_ids[m_clippedTriangles]])
+        m_usedIds, m_connectivity = np.unique(m_allTriangles, return_inverse=True)
+        return NumpyToPolyData(m_allPoints[m_usedIds], m_connectivity.reshape(-1, 3))
+
+    @TRACER.Traced("clip")
+    def PartitionedClipSpheres(self, m_target, m_holelist, m_holeRadius, m_analytic=False, m_processes=2):
+        """
+        Clip a surface with the hole spheres in parallel worker processes. Cells are partitioned into slabs along
+        the longest axis of the surface, neighbouring blocks share the points on their seams. Each block is
+        clipped with the holes near it and the clipped blocks are merged back with exact duplicate point merging,
+        so the seams are closed again.
+
+        :param m_target:        [vtkPolyData] Surface to clip
+        :param m_holelist:      [list]  A list of coordinates where holes are to be drilled
+        :param m_holeRadius:    [float] The radius of the hole to drill
+        :param m_analytic:      [bool]  Clip against the analytic union of the spheres
+        :param m_processes:     [int]   Number of worker processes
+        :return: [vtkPolyData]
+        """
+        m_points, m_triangles = PolyDataToNumpy(m_target)
+        m_holes = np.asarray(m_holelist, dtype=float).reshape(-1, 3)
+        m_maxEdge = GetMaxEdgeLength(m_points, m_triangles)
+
+        # Slabs with equal number of cells along the longest axis
+        m_centroids = m_points[m_triangles].mean(axis=1)
+        m_axis = np.argmax(np.ptp(m_centroids, axis=0))
+        m_numberOfBlocks = max(m_processes * 2, 1)
+        m_bounds = np.percentile(m_centroids[:, m_axis], np.linspace(0, 100, m_numberOfBlocks + 1)[1:-1])
+        m_blockIds = np.searchsorted(m_bounds, m_centroids[:, m_axis], side='right')
+
+        # The nearest glyph surface of a point on a cut edge lies within 2 radius plus an edge of the block
+        m_reach = 2 * m_holeRadius + m_maxEdge
+        m_blocks = []
+        m_jobs = []
+        for k in xrange(m_numberOfBlocks):
+            l_ids, l_connectivity = np.unique(m_triangles[m_blockIds == k], return_inverse=True)
+            if len(l_ids) == 0:
+                continue
+            l_points = m_points[l_ids]
+            l_connectivity = l_connectivity.reshape(-1, 3)
+            l_near = np.all((m_holes >= l_points.min(axis=0) - m_reach) &
+                            (m_holes <= l_points.max(axis=0) + m_reach), axis=1)
+            if np.any(l_near):
+                m_jobs.append((l_points, l_connectivity, m_holes[l_near], m_holeRadius, m_analytic))
+            else:
+                m_blocks.append((l_points, l_connectivity))
+
+        if len(m_jobs) != 0:
+            m_pool = multiprocessing.Pool(min(m_processes, len(m_jobs)))
+            try:
+                m_blocks.extend(m_pool.map(ClipSpheresBlock, m_jobs))
+            finally:
+                m_pool.terminate()
+                m_pool.join()
+
+        # Stack the blocks and merge the duplicated seam points
+        m_offsets = np.cumsum([0] + [len(l_points) for l_points, l_triangles in m_blocks])
+        m_allPoints = np.vstack([l_points for l_points, l_triangles in m_blocks])
+        m_allTriangles = np.vstack([l_triangles + m_offsets[k] for k, (l_points, l_triangles) in enumerate(m_blocks)])
+
+        m_clean = vtk.vtkCleanPolyData()
+        m_clean.SetInputData(NumpyToPolyData(m_allPoints, m_allTriangles))
+        m_clean.PointMergingOn()
+        m_clean.SetTolerance(0)
+        m_clean.ConvertPolysToLinesOff()
+        m_clean.ConvertLinesToPointsOff()
+        m_clean.ConvertStripsToPolysOff()
+        m_clean.Update()
+        return m_clean.GetOutput()
+
+    @TRACER.Traced("drill")
+    def SphereDrill(self, m_holelist, m_holeRadius, m_quiet=False, m_localized=False, m_margin=None,
+                    m_analytic=False, m_intersect=False, m_processes=1):
         """
         Drill sphere at locations specified by m_holelist.
 
+        In localized mode only the cells near the holes are extracted and clipped, then stitched back onto the
+        untouched remainder of the surface, see GetDrillRegion().
+
+        In analytic mode the surface is clipped against the exact union of the spheres, see SphereUnionDistance(),
+        instead of the distance to a tessellated glyph of the spheres.
+
+        With more than one process the clip is partitioned into spatial blocks, see PartitionedClipSpheres().
+
         :param m_holelist:      [list]  A list of coordinates where holes are to be drilled
         :param m_holeRadius:    [float] The radius of the hole to drill
         :param m_quiet:         [bool]
+        :param m_localized:     [bool]  Only clip the cells near the holes
+        :param m_margin:        [float] Extra distance around the holes of the localized region
+        :param m_analytic:      [bool]  Clip against the analytic union of the spheres
+        :param m_intersect:     [bool]  Also run vtkIntersectionPolyDataFilter with the sphere glyphs
+        :param m_processes:     [int]   Number of worker processes clipping the surface
         :return:
         """
-        m_totalNumOfHoles = len(m_holelist)
         if not m_quiet:
             t = time.time()
             print "Drilling"
 
-        # Forms a polydata with the hole list
-        pts = vtk.vtkPoints()
-        pd = vtk.vtkPolyData()
-        for i in xrange(m_totalNumOfHoles):
-            pts.InsertNextPoint(m_holelist[i])
-        pd.SetPoints(pts)
-
-        # Use glyph to create spheres
-        sphereSource = vtk.vtkSphereSource()
-        sphereSource.SetPhiResolution(10)
-        sphereSource.SetThetaResolution(10)
-        sphereSource.SetRadius(m_holeRadius)
-        sphereSource.Update()
-        glyph = vtk.vtkGlyph3D()
-        glyph.SetInputData(pd)
-        glyph.SetSourceConnection(sphereSource.GetOutputPort())
-        glyph.Update()
-
-        # writer = vtk.vtkXMLPolyDataWriter()
-        # writer.SetInputData(glyph.GetOutput())
-        # writer.SetFileName("./Output/glyph.vtp")
-        # writer.Update()
-        # writer.Write()
-
-        # Intersect generates better edges
-        intersect = vtk.vtkIntersectionPolyDataFilter()
-        intersect.SetInputData(0, self._data)
-        intersect.SetInputData(1, glyph.GetOutput())
-        intersect.SplitFirstOutputOn()
-        intersect.Update()
+        # Only the cells near the holes are clipped in localized mode
+        if m_localized:
+            m_cellMask = self.GetDrillRegion(m_holelist, m_holeRadius, m_margin)
+            m_points, m_triangles = self.GetTriangleArrays()
+            m_regionIds, m_regionConnectivity = np.unique(m_triangles[m_cellMask], return_inverse=True)
+            m_target = NumpyToPolyData(m_points[m_regionIds], m_regionConnectivity.reshape(-1, 3))
+            del m_points, m_triangles, m_regionIds, m_regionConnectivity
+        else:
+            m_target = self._data
+
+        if self._lean:
+            self.ReleaseMemory()
+
+        if m_intersect:
+            # Intersect generates better edges
+            intersect = vtk.vtkIntersectionPolyDataFilter()
+            intersect.SetInputData(0, m_target)
+            intersect.SetInputData(1, CreateSphereGlyph(m_holelist, m_holeRadius))
+            intersect.SplitFirstOutputOn()
+            intersect.Update()
 
         # Finally, clip the polydata
-        clipFunc = vtk.vtkImplicitPolyDataDistance()
-        clipFunc.SetInput(glyph.GetOutput())
+        if m_processes > 1:
+            m_clipped = self.PartitionedClipSpheres(m_target, m_holelist, m_holeRadius, m_analytic, m_processes)
+        else:
+            m_clipped = ClipSpheres(m_target, m_holelist, m_holeRadius, m_analytic)
 
-        clipper = vtk.vtkClipPolyData()
-        clipper.SetInputData(self._data)
-        clipper.SetClipFunction(clipFunc)
-        clipper.Update()
-        self._data.DeepCopy(clipper.GetOutput())
+        if m_localized:
+            m_clipped = self.MergeDrillRegion(m_clipped, m_cellMask)
+
+        # In lean mode the surface takes over the arrays of the clip output and releases its own
+        if self._lean:
+            self._data.ShallowCopy(m_clipped)
+        else:
+            self._data.DeepCopy(m_clipped)
+        del m_target, m_clipped
 
         if not m_quiet:
             print "Finished: Totaltime used = %.2f s" % (time.time() - t)
         pass
 
     def GetOpenningLine(self):
-        m_polydata = vtk.vtkPolyData()
-        m_cells = vtk.vtkCellArray()
-        m_points = vtk.vtkPoints()
-        for subList in self._openingList:
-            if (len(subList) == 0):
-                continue
-            l_polyline = vtk.vtkPolyLine()
-
-            for i in xrange(len(subList)):
-                m_points.InsertNextPoint(subList[i])
-                l_polyline.GetPointIds().InsertNextId(m_points.GetNumberOfPoints() - 1)
-
-            m_cells.InsertNextCell(l_polyline)
+        """
+        Return the opening lines of the last planned grid, see HoleGrid.GetOpeningLine()
+        Require sequence: GetSemiUniDistnaceGrid()
 
-        m_polydata.SetPoints(m_points)
-        m_polydata.SetLines(m_cells)
-        return m_polydata
+        :return: [vtkPolyData]
+        """
+        if self._holeGrid == None:
+            return HoleGrid(np.zeros([0, 3]), [], []).GetOpeningLine()
+        return self._holeGrid.GetOpeningLine()
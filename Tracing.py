@@ -0,0 +1,203 @@
+#!/usr/bin/python
+"""
+Lightweight tracing of the hole driller stages. Spans time the stages, counters count events and record values
+such as ring sizes, and the peak resident memory of the process is reported with them. Tracing is off until
+TRACER.Enable() is called, disabled spans cost a single flag check.
+
+Spans of forked worker processes are not collected, the span around the work handed to them is.
+"""
+
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+
+
+class Tracer(object):
+    def __init__(self):
+        """
+        Create a disabled Tracer object
+
+        :return:
+        """
+        self._enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.Reset()
+
+    def Enable(self):
+        """
+        Clear everything recorded so far and start tracing
+
+        :return:
+        """
+        self.Reset()
+        self._enabled = True
+
+    def Disable(self):
+        self._enabled = False
+        pass
+
+    def IsEnabled(self):
+        return self._enabled
+
+    def Reset(self):
+        """
+        Clear the recorded spans and counters
+
+        :return:
+        """
+        with self._lock:
+            self._start = time.time()
+            self._spans = []
+            self._counters = {}
+        pass
+
+    def Span(self, m_name):
+        """
+        Return a context manager timing the enclosed block as a span named m_name.
+
+        :param m_name:  [str] Name of the stage
+        :return:
+        """
+        if not self._enabled:
+            return _NULL_SPAN
+        return _Span(self, m_name)
+
+    def Traced(self, m_name):
+        """
+        Decorator timing every call of the decorated function as a span named m_name.
+
+        :param m_name:  [str] Name of the stage
+        :return:
+        """
+        def Decorator(m_function):
+            @functools.wraps(m_function)
+            def Wrapper(*args, **kwargs):
+                if not self._enabled:
+                    return m_function(*args, **kwargs)
+                with _Span(self, m_name):
+                    return m_function(*args, **kwargs)
+            return Wrapper
+        return Decorator
+
+    def Count(self, m_name, m_value=1):
+        """
+        Add a value to a counter. The number of values, their sum, minimum and maximum are kept.
+
+        :param m_name:  [str]   Name of the counter
+        :param m_value: [float] Value to add. Default to 1, i.e. counting events
+        :return:
+        """
+        if not self._enabled:
+            return
+        with self._lock:
+            m_counter = self._counters.get(m_name)
+            if m_counter == None:
+                self._counters[m_name] = {"count": 1, "sum": m_value, "min": m_value, "max": m_value}
+            else:
+                m_counter["count"] += 1
+                m_counter["sum"] += m_value
+                m_counter["min"] = min(m_counter["min"], m_value)
+                m_counter["max"] = max(m_counter["max"], m_value)
+        pass
+
+    def GetPeakRSS(self):
+        """
+        Return the peak resident set size of the process in kB
+
+        :return: [int]
+        """
+        m_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":  # Reported in bytes on macOS
+            m_peak //= 1024
+        return m_peak
+
+    def GetSummary(self):
+        """
+        Return the number of calls, total and maximum time of every span name
+
+        :return: [dict]
+        """
+        m_summary = {}
+        with self._lock:
+            for l_span in self._spans:
+                l_entry = m_summary.setdefault(l_span["name"], {"count": 0, "total": 0., "max": 0.})
+                l_entry["count"] += 1
+                l_entry["total"] += l_span["duration"]
+                l_entry["max"] = max(l_entry["max"], l_span["duration"])
+        return m_summary
+
+    def ToDict(self):
+        """
+        Return everything recorded as a json serializable dictionary
+
+        :return: [dict]
+        """
+        with self._lock:
+            m_spans = list(self._spans)
+            m_counters = dict((k, dict(v)) for k, v in self._counters.items())
+        return {"totalTime": time.time() - self._start,
+                "peakRSS": self.GetPeakRSS(),
+                "summary": self.GetSummary(),
+                "counters": m_counters,
+                "spans": m_spans}
+
+    def Write(self, m_filename):
+        """
+        Write everything recorded to a json trace file
+
+        :param m_filename:  [str] Output file name
+        :return:
+        """
+        with open(m_filename, 'w') as f:
+            json.dump(self.ToDict(), f, indent=2, sort_keys=True)
+        pass
+
+    def _Push(self, m_name):
+        m_stack = getattr(self._local, "stack", None)
+        if m_stack == None:
+            m_stack = self._local.stack = []
+        m_stack.append(m_name)
+        return len(m_stack) - 1
+
+    def _Pop(self, m_name, m_start, m_depth):
+        self._local.stack.pop()
+        with self._lock:
+            self._spans.append({"name": m_name,
+                                "start": m_start - self._start,
+                                "duration": time.time() - m_start,
+                                "depth": m_depth,
+                                "thread": threading.current_thread().name})
+        pass
+
+
+class _Span(object):
+    def __init__(self, tracer, name):
+        self._tracer = tracer
+        self._name = name
+
+    def __enter__(self):
+        self._depth = self._tracer._Push(self._name)
+        self._start = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self._tracer._Pop(self._name, self._start, self._depth)
+        return False
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+# Tracer shared by the whole process
+TRACER = Tracer()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+"""
+The VTK classes used by the hole driller. With VTK 8.2 or newer only the vtkmodules the pipeline needs are
+loaded, older VTK falls back to the vtk package which loads every module. Rendering classes are not loaded until
+LoadRendering() is called, so that headless runs never load the rendering modules.
+
+Use it in place of the vtk package, e.g. import VTKModules as vtk
+"""
+
+try:
+    from vtkmodules.vtkCommonComputationalGeometry import vtkCardinalSpline
+    from vtkmodules.vtkCommonCore import mutable, vtkIdList, vtkMath, vtkPoints, vtkVersion
+    from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkCellLocator, vtkKdTreePointLocator, vtkPlane, \
+        vtkPolyData
+    from vtkmodules.vtkFiltersCore import vtkCleanPolyData, vtkClipPolyData, vtkCutter, vtkDecimatePro, \
+        vtkGlyph3D, vtkMassProperties, vtkTriangleFilter
+    from vtkmodules.vtkFiltersGeneral import vtkIntersectionPolyDataFilter, vtkSplineFilter
+    from vtkmodules.vtkFiltersSources import vtkSphereSource
+    from vtkmodules.vtkIOGeometry import vtkSTLReader, vtkSTLWriter
+    from vtkmodules.vtkIOXML import vtkXMLPolyDataReader, vtkXMLPolyDataWriter
+    from vtkmodules.util import numpy_support
+    try:
+        from vtkmodules.vtkFiltersCore import vtkImplicitPolyDataDistance
+    except ImportError:
+        # Moved between modules across VTK versions
+        from vtkmodules.vtkCommonDataModel import vtkImplicitPolyDataDistance
+    HAS_VTKMODULES = True
+except ImportError:
+    from vtk import mutable, vtkCardinalSpline, vtkCellArray, vtkCellLocator, vtkCleanPolyData, vtkClipPolyData, \
+        vtkCutter, vtkDecimatePro, vtkGlyph3D, vtkIdList, vtkImplicitPolyDataDistance, \
+        vtkIntersectionPolyDataFilter, vtkKdTreePointLocator, vtkMassProperties, vtkMath, vtkPlane, vtkPoints, \
+        vtkPolyData, vtkSphereSource, vtkSplineFilter, vtkSTLReader, vtkSTLWriter, vtkTriangleFilter, vtkVersion, \
+        vtkXMLPolyDataReader, vtkXMLPolyDataWriter
+    from vtk.util import numpy_support
+    HAS_VTKMODULES = False
+
+RENDERING_CLASSES = ["vtkActor", "vtkPNGWriter", "vtkPolyDataMapper", "vtkRenderer", "vtkRenderWindow",
+                     "vtkRenderWindowInteractor", "vtkWindowToImageFilter"]
+
+
+def LoadRendering():
+    """
+    Load the rendering classes into this module, together with the OpenGL backend and the interactor styles.
+    Does nothing if they are loaded already.
+
+    :return:
+    """
+    if "vtkRenderer" in globals():
+        return
+
+    if HAS_VTKMODULES:
+        import vtkmodules.vtkInteractionStyle
+        import vtkmodules.vtkRenderingOpenGL2
+        from vtkmodules import vtkIOImage, vtkRenderingCore
+        m_modules = [vtkRenderingCore, vtkIOImage]
+    else:
+        import vtk
+        m_modules = [vtk]
+
+    for l_name in RENDERING_CLASSES:
+        for l_module in m_modules:
+            if hasattr(l_module, l_name):
+                globals()[l_name] = getattr(l_module, l_name)
+                break
+    pass